@@ -0,0 +1,375 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+import tkinter as tk
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import Kernels
+from Sugarscape import World, get_neighbor_table
+from Raster import Raster
+from Visualization import Canvas, Plot
+
+
+SEED = 0
+QUICK = {"grid_sizes": [50, 200, 500], "pops": [200, 10**4]}
+FULL = {"grid_sizes": [50, 200, 500, 1000, 2000], "pops": [200, 10**4, 10**5, 10**6]}
+# at most this share of the cells is populated, so placement always succeeds
+MAX_DENSITY = 0.5
+
+
+def summarize(times):
+    return {"median": statistics.median(times), "min": min(times), "repeat": len(times)}
+
+
+def timed(func, repeat):
+    """
+    Calls func repeat times and returns the seconds of each call
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def build_world(grid_size, pop, update="sequential", canvas=None):
+    """
+    World with the state create_resource and create_agent need, but not
+    created yet, so each step can be timed on its own
+    """
+    world = World(canvas, grid_size=grid_size, pop=pop, seed=SEED, update=update)
+    world.neighbors = get_neighbor_table(world.grid_size, world.max_vision)
+    world.create_grid()
+    return world
+
+
+def bench_init(grid_size, pop, repeat, update):
+    worlds = [build_world(grid_size, pop, update) for _ in range(repeat)]
+    resource = timed(lambda: worlds.pop().create_resource(), repeat)
+
+    worlds = [build_world(grid_size, pop, update) for _ in range(repeat)]
+    for world in worlds:
+        world.create_resource()
+    agent = timed(lambda: worlds.pop().create_agent(), repeat)
+
+    return summarize(resource), summarize(agent)
+
+
+def bench_ticks(grid_size, pop, ticks, update):
+    """
+    Times every tick of one headless run; the median is the cost of a tick
+    """
+    world = build_world(grid_size, pop, update)
+    world.initialize()
+    return summarize(timed(lambda: world.run(render=False), ticks))
+
+
+class NullWidget(object):
+    """
+    Stands in for the tkinter canvas when there is no display, counting the
+    item calls, so the benchmark times the Python side of Canvas.render
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def call(self, *args, **kwargs):
+        self.calls += 1
+
+    create_rectangle = create_oval = itemconfig = move = delete = call
+
+    def grid(self, **kwargs):
+        pass
+
+    def grid_remove(self):
+        pass
+
+    def __setitem__(self, key, value):
+        pass
+
+
+class NullWidgetCanvas(Canvas):
+    def create_widget(self, frame, row, col):
+        return NullWidget()
+
+
+class AggPlot(Plot):
+    """
+    Plot drawing into off-screen Agg canvases, for runs without a display
+    """
+    def figure_canvas(self, plot, row, col):
+        return FigureCanvasAgg(plot)
+
+
+def open_display():
+    """
+    Returns a hidden Tk root, or None when there is no display (run under
+    xvfb-run to time the real widgets on a headless machine)
+    """
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    root.withdraw()
+    return root
+
+
+def bench_canvas(grid_size, pop, ticks, root):
+    """
+    Times the first full draw of a world and the incremental draw of each
+    following tick, on a real Tk canvas when root is given
+    """
+    canvas = Canvas(root, 0, 0) if root is not None else NullWidgetCanvas(None, 0, 0)
+    flush = root.update if root is not None else (lambda: None)
+
+    world = World(canvas, grid_size=grid_size, pop=pop, seed=SEED)
+    world.neighbors = get_neighbor_table(world.grid_size, world.max_vision)
+    world.create_grid()
+    world.create_resource()
+    world.create_agent()
+
+    def draw():
+        canvas.render(world)
+        flush()
+
+    first = timed(draw, 1)
+    frames = []
+    for _ in range(ticks):
+        world.run(render=False)
+        frames += timed(draw, 1)
+
+    canvas.delete()
+    return summarize(first), summarize(frames)
+
+
+def bench_raster(grid_size, pop, ticks):
+    world = World(grid_size=grid_size, pop=pop, seed=SEED)
+    world.initialize()
+    raster = Raster()
+
+    frames = []
+    for _ in range(ticks):
+        world.run(render=False)
+        frames += timed(lambda: raster.frame(world, 700), 1)
+    return summarize(frames)
+
+
+def bench_plot(samples, root):
+    """
+    Times Plot.draw after each of samples ticks, blits and rescales included
+    """
+    plot = Plot(root) if root is not None else AggPlot(None)
+    flush = root.update if root is not None else (lambda: None)
+
+    rng = np.random.default_rng(SEED)
+    draws = []
+    for t in range(1, samples + 1):
+        plot.add(t, rng.random(len(plot.plot_names)) * t)
+
+        start = time.perf_counter()
+        plot.draw()
+        flush()
+        draws.append(time.perf_counter() - start)
+    return summarize(draws)
+
+
+def run_suite(sizes, ticks=10, repeat=3, update="sequential", only=None, log=sys.stderr):
+    """
+    Runs every benchmark of the suite and returns name -> summary. Cases
+    whose name does not contain only are skipped
+    """
+    results = {}
+
+    def record(name, summary):
+        results[name] = summary
+        print("%-45s %10.3f ms" % (name, 1000*summary["median"]), file=log)
+
+    def wanted(name):
+        return only is None or only in name
+
+    cases = [(grid_size, pop) for grid_size in sizes["grid_sizes"] for pop in sizes["pops"]
+             if pop <= MAX_DENSITY*grid_size*grid_size]
+
+    for grid_size, pop in cases:
+        case = "/grid=%d/pop=%d" % (grid_size, pop)
+        if wanted("init" + case):
+            resource, agent = bench_init(grid_size, pop, repeat, update)
+            record("init.create_resource" + case, resource)
+            record("init.create_agent" + case, agent)
+        if wanted("tick" + case):
+            record("tick." + update + case, bench_ticks(grid_size, pop, ticks, update))
+
+    root = open_display()
+    backend = "tk" if root is not None else "null"
+
+    # item canvases beyond a few ten thousand cells are not usable anyway
+    for grid_size, pop in cases:
+        case = "/grid=%d/pop=%d" % (grid_size, pop)
+        if grid_size <= 200 and wanted("render.canvas" + case):
+            first, frame = bench_canvas(grid_size, pop, ticks, root)
+            record("render.canvas." + backend + ".first" + case, first)
+            record("render.canvas." + backend + ".frame" + case, frame)
+        if wanted("render.raster" + case):
+            record("render.raster" + case, bench_raster(grid_size, pop, ticks))
+
+    if wanted("plot.draw"):
+        record("plot.draw." + backend, bench_plot(10*ticks, root))
+
+    if root is not None:
+        root.destroy()
+    return results
+
+
+def world_state(world):
+    n = world.agents.count
+    state = {name: getattr(world.agents, name)[:n].copy() for name in world.agents.columns()}
+    state["sugar"] = np.array(world.landscape.get_sugar_grid())
+    state["occupancy"] = np.array(world.grid_occupancy)
+    return state
+
+
+def check_equivalent(first, second, seeds=range(5), ticks=100):
+    """
+    Runs each seed as two worlds, built and stepped with the first and the
+    second setup, and returns the (seed, tick) pairs where their agents,
+    sugar or occupancy first differ, or an empty list when every trajectory
+    is identical. A setup is (world_args, jit): the World arguments and
+    whether the compiled kernel steps the world
+    """
+    mismatches = []
+    enabled = Kernels.enabled
+    try:
+        for seed in seeds:
+            worlds = []
+            for world_args, jit in (first, second):
+                Kernels.set_enabled(jit)
+                world = World(seed=seed, **world_args)
+                world.initialize()
+                worlds.append((jit, world))
+
+            for tick in range(1, ticks + 1):
+                states = []
+                for jit, world in worlds:
+                    Kernels.set_enabled(jit)
+                    world.run(render=False)
+                    states.append(world_state(world))
+
+                a, b = states
+                if any(not np.array_equal(a[name], b[name]) for name in a):
+                    mismatches.append((seed, tick))
+                    break
+    finally:
+        Kernels.set_enabled(enabled)
+    return mismatches
+
+
+def check_jit(seeds=range(5), ticks=100, **world_args):
+    """
+    Compares the compiled kernel against the Python loop, see check_equivalent
+    """
+    if not Kernels.is_available():
+        raise RuntimeError("numba is not installed, there is no compiled kernel to check")
+    return check_equivalent((world_args, True), (world_args, False), seeds, ticks)
+
+
+def check_storage(seeds=range(5), ticks=100, **world_args):
+    """
+    Compares lazy regrowth against eager regrowth and tiled grids against
+    dense ones, which must give bit-identical trajectories; returns
+    (name, mismatches) per comparison
+    """
+    dense = dict(world_args, regrowth="eager")
+    return [(name, check_equivalent((dense, Kernels.enabled), (dict(dense, **variant), Kernels.enabled),
+                                    seeds, ticks))
+            for name, variant in [("lazy", {"regrowth": "lazy"}), ("tiled", {"tile_size": 16})]]
+
+
+def environment():
+    return {"python": platform.python_version(),
+            "numpy": np.__version__,
+            "jit": Kernels.enabled,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": SEED,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns (name, baseline, current, ratio, regressed) for every case in
+    both runs; a case regresses when its median grew by more than threshold
+    """
+    rows = []
+    for name in sorted(set(results) & set(baseline)):
+        before, after = baseline[name]["median"], results[name]["median"]
+        ratio = after / before if before > 0 else float("inf")
+        rows.append((name, before, after, ratio, ratio > 1 + threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the Sugarscape tick, initialization and rendering")
+    parser.add_argument("--full", action="store_true", help="grids up to 2000 and populations up to 10^6")
+    parser.add_argument("--ticks", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--update", default="sequential", choices=["sequential", "synchronous"])
+    parser.add_argument("--only", default=None, help="only run cases whose name contains this")
+    parser.add_argument("--out", default=None, help="write the results as JSON here instead of stdout")
+    parser.add_argument("--baseline", default=None, help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="relative slowdown of the median that counts as a regression")
+    parser.add_argument("--check-jit", action="store_true",
+                        help="only check that the compiled and Python kernels give identical trajectories")
+    parser.add_argument("--check-storage", action="store_true",
+                        help="only check that lazy regrowth and tiled grids give the trajectories of eager, "
+                             "dense worlds")
+    args = parser.parse_args(argv)
+
+    if args.check_jit or args.check_storage:
+        mismatches = []
+        for world_args in [{}, {"regrowth": "lazy"}, {"update": "synchronous"}, {"grid_size": 60, "pop": 1500}]:
+            checks = []
+            if args.check_jit:
+                checks.append(("jit", check_jit(ticks=args.ticks*10, **world_args)))
+            # the storage checks pick the regrowth themselves
+            if args.check_storage and "regrowth" not in world_args:
+                checks += check_storage(ticks=args.ticks*10, **world_args)
+            for name, found in checks:
+                print("%-6s %-35s %s" % (name, json.dumps(world_args),
+                                         "differs at %s" % found if found else "identical"), file=sys.stderr)
+                mismatches += found
+        return 1 if mismatches else 0
+
+    results = run_suite(FULL if args.full else QUICK, args.ticks, args.repeat, args.update, args.only)
+    report = {"environment": environment(), "results": results}
+
+    if args.out is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+
+    regressions = 0
+    for name, before, after, ratio, regressed in compare(results, baseline, args.threshold):
+        regressions += regressed
+        print("%-45s %10.3f -> %10.3f ms  x%.2f%s" % (name, 1000*before, 1000*after, ratio,
+                                                     "  REGRESSION" if regressed else ""), file=sys.stderr)
+    print("%d regressions over %.0f%%" % (regressions, 100*args.threshold), file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
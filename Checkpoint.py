@@ -0,0 +1,182 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from Sugarscape import World, Landscape, LazyLandscape, TiledLandscape, TiledGrid, AgentStore, get_neighbor_table
+
+
+FORMAT_VERSION = 1
+PARAMETERS = ["width", "height", "grid_size", "radius", "peaks", "region", "on_sugar", "regrowth",
+              "max_vision", "max_metabolism", "update", "workers", "tile_size"]
+
+
+def seed_state(seed_sequence):
+    return {"entropy": seed_sequence.entropy,
+            "spawn_key": list(seed_sequence.spawn_key),
+            "spawned": seed_sequence.n_children_spawned}
+
+
+def restore_seed(state):
+    return np.random.SeedSequence(state["entropy"], spawn_key=state["spawn_key"],
+                                  n_children_spawned=state["spawned"])
+
+
+def rng_state(rng):
+    return {"seed": seed_state(rng.bit_generator.seed_seq), "state": rng.bit_generator.state}
+
+
+def restore_rng(state):
+    rng = np.random.default_rng(restore_seed(state["seed"]))
+    rng.bit_generator.state = state["state"]
+    return rng
+
+
+def world_arrays(world):
+    """
+    Returns the arrays of a world by file name, agent columns trimmed to the
+    population (keeping one row so the store can grow again). A TiledGrid is
+    stored as its directory and its allocated tiles
+    """
+    landscape = world.landscape
+    grids = {"capacity": landscape.capacity,
+             "sugar_level": landscape.sugar_level,
+             "occupancy": world.grid_occupancy}
+
+    arrays = {}
+    for name, grid in grids.items():
+        if isinstance(grid, TiledGrid):
+            arrays[name + ".directory"] = grid.directory
+            arrays[name + ".tiles"] = grid.active_tiles()
+        else:
+            arrays[name] = grid
+    if isinstance(landscape, LazyLandscape):
+        arrays["set_tick"] = landscape.set_tick
+
+    rows = max(world.agents.count, 1)
+    for name in world.agents.columns():
+        arrays["agents." + name] = getattr(world.agents, name)[:rows]
+    return arrays
+
+
+def world_meta(world):
+    params = {name: getattr(world, name) for name in PARAMETERS}
+    params["pop"] = world.agent_pop
+
+    return {"version": FORMAT_VERSION,
+            "params": params,
+            "tick": world.tick,
+            "landscape_tick": world.landscape.tick,
+            "count": world.agents.count,
+            "next_id": world.agents.next_id,
+            "seed_sequence": seed_state(world.seed_sequence),
+            "rng": rng_state(world.rng),
+            "move_rng": rng_state(world.move_rng)}
+
+
+def save_world(world, path, compress=False):
+    """
+    Writes the full state of a world.
+    -by default path is a directory holding meta.json and one .npy file per
+     array, which load_world can memory map
+    -with compress=True path is a single compressed .npz file, smaller but
+     read into memory on load
+    The checkpoint is written next to path first and then moved over it, so
+    a crash while saving leaves the previous checkpoint intact.
+    """
+    arrays = world_arrays(world)
+    meta = json.dumps(world_meta(world))
+    temp = path + ".tmp"
+
+    if compress:
+        with open(temp, "wb") as f:
+            np.savez_compressed(f, meta=np.array(meta), **arrays)
+        os.replace(temp, path)
+        return
+
+    if os.path.exists(temp):
+        shutil.rmtree(temp)
+    os.makedirs(temp)
+    for name, array in arrays.items():
+        np.save(os.path.join(temp, name + ".npy"), np.ascontiguousarray(array))
+    with open(os.path.join(temp, "meta.json"), "w") as f:
+        f.write(meta)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(temp, path)
+
+
+def read_checkpoint(path, mmap=True):
+    """
+    Returns (meta, arrays) of a checkpoint directory or .npz file
+    """
+    if not os.path.isdir(path):
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        return json.loads(str(arrays.pop("meta"))), arrays
+
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+
+    arrays = {}
+    for name in os.listdir(path):
+        if name.endswith(".npy"):
+            # copy on write: the world runs on the mapped arrays without ever
+            # writing back to the checkpoint
+            arrays[name[:-4]] = np.load(os.path.join(path, name), mmap_mode="c" if mmap else None)
+    return meta, arrays
+
+
+def read_grid(arrays, name, grid_size, fill):
+    if name + ".tiles" not in arrays:
+        return arrays[name]
+    return TiledGrid.from_tiles(grid_size, arrays[name + ".directory"], arrays[name + ".tiles"], fill)
+
+
+def load_world(path, canvas=None, mmap=True):
+    """
+    Rebuilds a world saved by save_world, ready to run from the saved tick
+    with the same random streams. Directory checkpoints are memory mapped
+    unless mmap is False, so loading does not depend on the world's size.
+    """
+    meta, arrays = read_checkpoint(path, mmap)
+    if meta["version"] != FORMAT_VERSION:
+        raise ValueError("Unsupported checkpoint version: " + str(meta["version"]))
+
+    world = World(canvas=canvas, seed=meta["seed_sequence"]["entropy"], **meta["params"])
+
+    world.seed_sequence = restore_seed(meta["seed_sequence"])
+    world.rng = restore_rng(meta["rng"])
+    world.move_rng = restore_rng(meta["move_rng"])
+    world.tick = meta["tick"]
+
+    world.neighbors = get_neighbor_table(world.grid_size, world.max_vision)
+    world.pos = world.peaks if world.peaks is not None else world.default_peaks()
+
+    if world.tile_size is not None:
+        landscape = TiledLandscape(0, world.tile_size)
+    else:
+        landscape = LazyLandscape(0) if world.regrowth == "lazy" else Landscape(0)
+    landscape.grid_size = world.grid_size
+    landscape.tick = meta["landscape_tick"]
+    landscape.capacity = read_grid(arrays, "capacity", world.grid_size, 0)
+    landscape.sugar_level = read_grid(arrays, "sugar_level", world.grid_size, 0)
+    if "set_tick" in arrays:
+        landscape.set_tick = arrays["set_tick"]
+    world.landscape = landscape
+    world.grid_occupancy = read_grid(arrays, "occupancy", world.grid_size, World.EMPTY)
+
+    agents = AgentStore()
+    for name in agents.columns():
+        setattr(agents, name, arrays["agents." + name])
+    agents.count = meta["count"]
+    agents.next_id = meta["next_id"]
+    world.agents = agents
+
+    if world.workers > 1:
+        from Domain import Domain
+        world.domain = Domain(world, world.workers)
+    world.render()
+    return world
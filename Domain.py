@@ -0,0 +1,198 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from Sugarscape import AgentStore, Landscape, LazyLandscape, get_neighbor_table, UPDATE_RULES
+
+
+class Domain(object):
+    """
+    Runs the ticks of one large world on several cores by splitting the
+    torus into vertical strips of columns.
+    -every strip is at least 2*max_vision columns wide and there is an even
+     number of them, so two strips of the same parity never reach the same
+     cell: an agent sees at most max_vision cells past its own strip
+    -a tick moves the agents of all strips of one parity in parallel, then
+     those of the other; which parity goes first is drawn from the world's
+     movement stream every tick, so neither side of a boundary always wins
+     the cells it contests. Within a strip agents move in row order with
+     the usual sequential rule, so the result is the serial update with the
+     agents taken in a different, still arbitrary, order
+    -an agent belongs to the strip holding its cell at the start of the
+     tick, so agents crossing a boundary migrate to the neighboring worker
+     on the next tick
+    The sugar, occupancy and agent columns of the world are moved into
+    shared memory, which the workers read and write in place; the halos an
+    agent reads across a strip boundary are the neighbor's own cells, so no
+    copies are exchanged. The strips only depend on the grid and the
+    vision, and each draws its tie-break keys from a stream spawned off the
+    world's movement stream, so a seed gives the same trajectory whatever
+    the number of workers.
+    """
+    MAX_STRIPS = 64
+
+    def __init__(self, world, workers):
+        self.world = world
+        self.workers = workers
+
+        num_strips = min(Domain.MAX_STRIPS, world.grid_size // (2*world.max_vision))
+        num_strips -= num_strips % 2
+        if num_strips < 2:
+            raise ValueError("Grid of %d cells is too small to split for vision %d"
+                             % (world.grid_size, world.max_vision))
+
+        self.bounds = np.linspace(0, world.grid_size, num_strips + 1).astype(np.int64)
+        self.num_strips = num_strips
+
+        self.blocks = {}
+        landscape = world.landscape
+        for name in self.landscape_columns():
+            setattr(landscape, name, self.share(name, getattr(landscape, name)))
+        world.grid_occupancy = self.share("occupancy", world.grid_occupancy)
+        self.share_agents()
+
+        self.pool = multiprocessing.Pool(processes=workers)
+
+    def landscape_columns(self):
+        columns = ["capacity", "sugar_level"]
+        if isinstance(self.world.landscape, LazyLandscape):
+            columns.append("set_tick")
+        return columns
+
+    def share(self, name, array):
+        """
+        Copies array into a new shared memory block and returns a view of it
+        """
+        self.release(name)
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        shared[...] = array
+
+        self.blocks[name] = (block, shared)
+        return shared
+
+    def release(self, name):
+        if name in self.blocks:
+            block, shared = self.blocks.pop(name)
+            del shared
+            block.close()
+            block.unlink()
+
+    def share_agents(self):
+        """
+        Moves the agent columns into shared memory, again whenever the store
+        has reallocated them
+        """
+        agents = self.world.agents
+        for name in agents.columns():
+            column = getattr(agents, name)
+            if name not in self.blocks or self.blocks[name][1] is not column:
+                setattr(agents, name, self.share(name, column))
+
+    def layout(self):
+        """
+        Describes the shared blocks to the workers: name -> (block, shape, dtype)
+        """
+        return {name: (block.name, shared.shape, shared.dtype.str) for name, (block, shared) in self.blocks.items()}
+
+    def grow(self, tick):
+        """
+        Grows the strips in parallel; lazy regrowth has nothing to do here
+        """
+        landscape = self.world.landscape
+        landscape.tick = tick
+        if isinstance(landscape, LazyLandscape):
+            return
+
+        layout = self.layout()
+        self.pool.map(grow_strip, [(layout, self.bounds[s], self.bounds[s+1]) for s in range(self.num_strips)])
+
+    def move_agents(self):
+        """
+        Assigns every agent to the strip of its cell, then moves the even
+        strips and the odd strips in two parallel phases, in random order
+        """
+        world = self.world
+        agents = world.agents
+        self.share_agents()
+
+        n = agents.count
+        strip = np.searchsorted(self.bounds, agents.x[:n], side="right") - 1
+        order = np.argsort(strip, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(np.bincount(strip, minlength=self.num_strips))))
+
+        if "order" not in self.blocks or len(self.blocks["order"][1]) < n:
+            self.share("order", np.zeros(max(n, 1), dtype=np.int64))
+        self.blocks["order"][1][:n] = order
+
+        seeds = world.move_rng.bit_generator.seed_seq.spawn(self.num_strips)
+        layout = self.layout()
+        grid = (world.grid_size, world.max_vision, type(world.landscape).__name__, world.landscape.tick,
+                world.update)
+
+        first = int(world.move_rng.integers(2))
+        for parity in (first, 1 - first):
+            tasks = [(layout, grid, starts[s], starts[s+1], seeds[s])
+                     for s in range(parity, self.num_strips, 2) if starts[s+1] > starts[s]]
+            self.pool.map(move_strip, tasks)
+
+    def close(self):
+        """
+        Stops the workers and gives the world private copies of its arrays
+        """
+        self.pool.close()
+        self.pool.join()
+
+        world = self.world
+        for name in self.landscape_columns():
+            setattr(world.landscape, name, getattr(world.landscape, name).copy())
+        world.grid_occupancy = world.grid_occupancy.copy()
+        for name in world.agents.columns():
+            setattr(world.agents, name, getattr(world.agents, name).copy())
+
+        for name in list(self.blocks):
+            self.release(name)
+
+
+# shared blocks a worker has attached to, by array name
+attached = {}
+
+
+def attach(layout, name):
+    block_name, shape, dtype = layout[name]
+    if name not in attached or attached[name].name != block_name:
+        if name in attached:
+            attached[name].close()
+        # pool workers share the parent's resource tracker, so attaching
+        # registers nothing new and only the parent unlinks the block
+        attached[name] = shared_memory.SharedMemory(name=block_name)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=attached[name].buf)
+
+
+def grow_strip(task):
+    layout, start, stop = task
+    strip = Landscape(0)
+    strip.capacity = attach(layout, "capacity")[start:stop]
+    strip.sugar_level = attach(layout, "sugar_level")[start:stop]
+    strip.grow(0)
+
+
+def move_strip(task):
+    layout, grid, start, stop, seed = task
+    grid_size, max_vision, kind, tick, update = grid
+
+    landscape = LazyLandscape(0) if kind == LazyLandscape.__name__ else Landscape(0)
+    landscape.tick = tick
+    for name in ["capacity", "sugar_level", "set_tick"]:
+        if name in layout:
+            setattr(landscape, name, attach(layout, name))
+
+    agents = AgentStore()
+    for name in agents.columns():
+        setattr(agents, name, attach(layout, name))
+
+    rows = attach(layout, "order")[start:stop]
+    occupancy = attach(layout, "occupancy").reshape(-1)
+    UPDATE_RULES[update](agents, rows, landscape, occupancy, get_neighbor_table(grid_size, max_vision),
+                         np.random.default_rng(seed))
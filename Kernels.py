@@ -0,0 +1,58 @@
+import os
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# occupancy value of a cell whose agent starved there this tick: free, but
+# eaten, so later agents must not move in
+STARVED = -2
+
+
+def sequential_moves(ranked_cells, ranked_sugar, num_ranked, own_cells, own_sugar, wealth, metabolism,
+                     row_ids, occupancy, empty, dead):
+    """
+    Walk of the sequential movement rule over arrays, the loop of
+    Sugarscape.move_rows: agent i takes its first ranked cell that is free,
+    eats there and starves below 0 wealth. own_cells and wealth are updated
+    in place, dead flags starved agents.
+    A cell eaten this tick is either held by the live agent that ate it or
+    marked STARVED in occupancy, so the "not yet eaten" test needs no set;
+    the caller frees the STARVED cells afterwards.
+    """
+    for i in range(len(own_cells)):
+        cell = own_cells[i]
+        gain = own_sugar[i]
+        for k in range(num_ranked[i]):
+            target = ranked_cells[i, k]
+            if occupancy[target] == empty:
+                occupancy[cell] = empty
+                occupancy[target] = row_ids[i]
+                cell = target
+                gain = ranked_sugar[i, k]
+                break
+
+        own_cells[i] = cell
+        wealth[i] += gain - metabolism[i]
+        if wealth[i] < 0:
+            dead[i] = True
+            occupancy[cell] = STARVED
+
+
+if numba is not None:
+    sequential_moves = numba.njit(cache=True, nogil=True)(sequential_moves)
+
+# the compiled kernel replaces the Python loop when numba is installed;
+# SUGARSCAPE_NO_JIT=1 or set_enabled(False) keeps the Python loop
+enabled = numba is not None and not os.environ.get("SUGARSCAPE_NO_JIT")
+
+
+def is_available():
+    return numba is not None
+
+
+def set_enabled(flag):
+    global enabled
+    enabled = bool(flag) and numba is not None
@@ -0,0 +1,154 @@
+import numpy as np
+
+
+class MetricsCollector(object):
+    """
+    Streaming per-tick statistics of a World's agents, from each tick's
+    TickEvents.
+    -vision and metabolism never change, so their running sums (and sums of
+     squares) are computed when the collector is attached and only the dead
+     agents are subtracted afterwards
+    -wealth changes for every agent every tick, so its sums and its exact
+     histogram, one bin per unit of sugar, are recomputed from the survivors
+    The Gini coefficient is computed from the histogram, in time proportional
+    to the highest wealth.
+    One record per tick is kept in a ring buffer of the last capacity ticks.
+    """
+    FIELDS = ["tick", "population", "deaths", "moves", "harvest",
+              "wealth_mean", "wealth_var", "vision_mean", "vision_var",
+              "metabolism_mean", "metabolism_var", "gini"]
+
+    def __init__(self, capacity=10000):
+        self.buffer = np.zeros(capacity, dtype=[(name, np.float64) for name in MetricsCollector.FIELDS])
+        self.num_records = 0
+
+        self.population = 0
+        self.sums = {}
+        self.histogram = np.zeros(0, dtype=np.int64)
+
+    def attach(self, world):
+        world.add_observer(self)
+        if hasattr(world, "agents"):
+            self.on_initialize(world)
+
+    def detach(self, world):
+        world.remove_observer(self)
+
+    def on_initialize(self, world):
+        agents = world.agents
+        n = agents.count
+
+        self.population = n
+        self.sums = {}
+        for name in ["wealth", "vision", "metabolism"]:
+            column = getattr(agents, name)[:n].astype(np.int64)
+            self.sums[name] = [int(column.sum()), int((column*column).sum())]
+
+        self.histogram = np.bincount(agents.wealth[:n])
+        self.record(world.tick, deaths=0, moves=0, harvest=0)
+
+    def on_tick(self, world, events):
+        dead = events.dead
+        alive = ~dead
+
+        wealth = events.wealth[alive].astype(np.int64)
+        self.sums["wealth"] = [int(wealth.sum()), int((wealth*wealth).sum())]
+        self.histogram = np.bincount(wealth)
+
+        num_dead = int(np.count_nonzero(dead))
+        if num_dead:
+            for name in ["vision", "metabolism"]:
+                column = getattr(events, name)[dead].astype(np.int64)
+                self.sums[name][0] -= int(column.sum())
+                self.sums[name][1] -= int((column*column).sum())
+
+        self.population -= num_dead
+
+        self.record(events.tick,
+                    deaths=num_dead,
+                    moves=int(np.count_nonzero(events.moved)),
+                    harvest=int(events.harvest.sum()))
+
+    def record(self, tick, deaths, moves, harvest):
+        row = self.buffer[self.num_records % len(self.buffer)]
+        row["tick"] = tick
+        row["population"] = self.population
+        row["deaths"] = deaths
+        row["moves"] = moves
+        row["harvest"] = harvest
+
+        for name in ["wealth", "vision", "metabolism"]:
+            mean, var = self.moments(name)
+            row[name + "_mean"] = mean
+            row[name + "_var"] = var
+
+        row["gini"] = self.gini()
+        self.num_records += 1
+
+    def moments(self, name):
+        if self.population == 0:
+            return 0.0, 0.0
+
+        total, total_sq = self.sums[name]
+        mean = total / self.population
+        return mean, max(0.0, total_sq / self.population - mean*mean)
+
+    def gini(self):
+        """
+        Gini coefficient of wealth, (2*sum(i*x_i))/(n*sum(x)) - (n+1)/n over
+        the sorted wealth x_1 <= ... <= x_n, with the ranks of every histogram
+        bin summed in closed form
+        """
+        n = self.population
+        total = self.sums["wealth"][0] if self.sums else 0
+        if n == 0 or total == 0:
+            return 0.0
+
+        counts = self.histogram
+        values = np.arange(len(counts), dtype=np.float64)
+        below = np.cumsum(counts) - counts
+        rank_sums = counts*below + counts*(counts + 1)/2.0
+
+        return float(2.0*np.dot(values, rank_sums)/(n*total) - (n + 1.0)/n)
+
+    def wealth_histogram(self, num_bins=10):
+        """
+        Returns (counts, edges) with the exact histogram merged into num_bins
+        bins of equal width
+        """
+        width = max(1, -(-len(self.histogram) // num_bins))
+        edges = np.arange(num_bins + 1) * width
+
+        padded = np.zeros(num_bins*width, dtype=np.int64)
+        padded[:len(self.histogram)] = self.histogram
+        return padded.reshape(num_bins, width).sum(axis=1), edges
+
+    def latest(self):
+        if self.num_records == 0:
+            return None
+        return self.buffer[(self.num_records - 1) % len(self.buffer)]
+
+    def records(self):
+        """
+        Returns the buffered records, oldest first
+        """
+        size = len(self.buffer)
+        if self.num_records <= size:
+            return self.buffer[:self.num_records].copy()
+
+        start = self.num_records % size
+        return np.concatenate((self.buffer[start:], self.buffer[:start]))
+
+    def stream(self, world, ticks=None):
+        """
+        Steps the world and yields each tick's record, forever when ticks is
+        None; the world is attached first if needed
+        """
+        if self not in world.observers:
+            self.attach(world)
+
+        tick = 0
+        while ticks is None or tick < ticks:
+            world.run()
+            yield self.latest().copy()
+            tick += 1
@@ -0,0 +1,141 @@
+import os
+import shutil
+import struct
+import subprocess
+import zlib
+
+import numpy as np
+
+from Sugarscape import RenderSink, Resource, Agent
+
+
+def hex_to_rgb(color):
+    color = color.lstrip("#")
+    return tuple(int(color[i:i+2], 16) for i in (0, 2, 4))
+
+
+class Raster(object):
+    """
+    Turns the sugar grid and agent positions of a world into one RGB frame
+    through a color lookup table, instead of one canvas item per cell.
+    Frames are indexed [row, column] = [y, x] like an image, with one pixel
+    per cell scaled to the requested size.
+    """
+    BACKGROUND = "#E0E0E0"
+
+    def __init__(self, background=BACKGROUND):
+        self.lut = np.zeros((Resource.MAX_CAPACITY + 1, 3), dtype=np.uint8)
+        self.lut[0] = hex_to_rgb(background)
+        for sugar in range(1, Resource.MAX_CAPACITY + 1):
+            self.lut[sugar] = hex_to_rgb(Resource.COLORS[sugar])
+
+        self.agent_rgb = np.array(hex_to_rgb(Agent.COLOR), dtype=np.uint8)
+
+    def frame(self, world, size=None):
+        """
+        Returns the world as a (height, width, 3) uint8 array. When size is
+        given the frame is zoomed or subsampled by a whole factor so that it
+        is as close to size pixels wide as possible without exceeding it.
+        """
+        image = self.lut[world.landscape.get_sugar_grid().T]
+
+        agents = world.agents
+        image[agents.y[:agents.count], agents.x[:agents.count]] = self.agent_rgb
+
+        if size is None:
+            return image
+
+        grid_size = world.get_grid_size()
+        if grid_size <= size:
+            zoom = size // grid_size
+            return np.repeat(np.repeat(image, zoom, axis=0), zoom, axis=1)
+
+        step = -(-grid_size // size)
+        return np.ascontiguousarray(image[::step, ::step])
+
+
+def encode_ppm(frame):
+    height, width = frame.shape[:2]
+    return b"P6 %d %d 255\n" % (width, height) + frame.tobytes()
+
+
+def encode_png(frame):
+    """
+    Encodes an RGB frame as an 8 bit truecolor PNG
+    """
+    height, width = frame.shape[:2]
+
+    rows = np.zeros((height, 1 + 3*width), dtype=np.uint8)
+    rows[:, 1:] = frame.reshape(height, 3*width)
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", header) +
+            chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)) +
+            chunk(b"IEND", b""))
+
+
+class FrameWriter(RenderSink):
+    """
+    Headless sink that writes every rendered frame to disk.
+    -a path ending in a video extension is encoded through ffmpeg, which
+     must be on the PATH
+    -any other path is a directory receiving frame_000000.png, ...
+    Call close() when the run is over to finish the video.
+    """
+    VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".mov", ".webm", ".gif")
+
+    def __init__(self, path, size=None, fps=10):
+        self.path = path
+        self.size = size
+        self.fps = fps
+        self.raster = Raster()
+
+        self.num_frames = 0
+        self.process = None
+        self.video = os.path.splitext(path)[1].lower() in FrameWriter.VIDEO_EXTENSIONS
+
+        if self.video and shutil.which("ffmpeg") is None:
+            raise RuntimeError("ffmpeg is required to write " + path)
+        if not self.video:
+            os.makedirs(path, exist_ok=True)
+
+    def render(self, world):
+        frame = self.raster.frame(world, self.size)
+
+        if self.video:
+            self.write_video_frame(frame)
+        else:
+            name = os.path.join(self.path, "frame_%06d.png" % self.num_frames)
+            with open(name, "wb") as f:
+                f.write(encode_png(frame))
+
+        self.num_frames += 1
+
+    def write_video_frame(self, frame):
+        if self.process is None:
+            height, width = frame.shape[:2]
+            command = ["ffmpeg", "-loglevel", "error", "-y",
+                       "-f", "rawvideo", "-pix_fmt", "rgb24",
+                       "-s", "%dx%d" % (width, height),
+                       "-r", str(self.fps),
+                       "-i", "-"]
+            if not self.path.lower().endswith(".gif"):
+                # most players need yuv420p, which needs even dimensions
+                command += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p"]
+
+            self.process = subprocess.Popen(command + [self.path], stdin=subprocess.PIPE)
+        self.process.stdin.write(frame.tobytes())
+
+    def delete(self):
+        pass
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
@@ -0,0 +1,124 @@
+import collections
+import json
+import time
+
+import numpy as np
+
+
+class TickStats(object):
+    """
+    Per-phase timers and counters of World.run, enabled with
+    World.enable_stats(). Each tick gives one record:
+    -the seconds spent in each of PHASES
+    -cells_grown: cells below capacity when the landscape grew
+    -vision_cells: cells on the vision rays of all agents
+    -moves and deaths of the tick
+    -cells_repainted: cells the render sink redrew, 0 when not rendered
+    The last history records are kept; with a stream every record is also
+    written to it as a CSV row or a JSON line. The counters that need a pass
+    over the grid or the agents are only computed while stats are enabled.
+    """
+    PHASES = ["grow", "move", "observers", "compact", "checkpoint", "render"]
+    COUNTERS = ["cells_grown", "vision_cells", "moves", "deaths", "cells_repainted"]
+    FIELDS = ["tick", "population"] + [phase + "_seconds" for phase in PHASES] + ["total_seconds"] + COUNTERS
+
+    def __init__(self, history=1000, stream=None, format="csv"):
+        if format not in ("csv", "json"):
+            raise ValueError("Unknown stats format: " + str(format))
+
+        self.history = collections.deque(maxlen=history)
+        self.stream = stream
+        self.format = format
+        self.header_written = False
+        self.record = None
+
+    def begin(self, world):
+        """
+        Starts the record of the tick about to run
+        """
+        agents = world.agents
+        n = agents.count
+
+        self.record = dict.fromkeys(TickStats.FIELDS, 0)
+        self.record["vision_cells"] = self.vision_cells(world.neighbors, agents.vision[:n])
+        self.x_before = agents.x[:n].copy()
+        self.y_before = agents.y[:n].copy()
+
+        self.record["cells_grown"] = world.landscape.count_below_capacity()
+
+        self.start = self.last = time.perf_counter()
+
+    def vision_cells(self, neighbors, vision):
+        per_vision = np.array([np.count_nonzero(neighbors.dist <= v) for v in range(neighbors.max_vision + 1)])
+        return int(np.dot(np.bincount(vision, minlength=len(per_vision))[:len(per_vision)], per_vision))
+
+    def mark(self, phase):
+        """
+        Charges the time since the previous mark to phase
+        """
+        now = time.perf_counter()
+        self.record[phase + "_seconds"] += now - self.last
+        self.last = now
+
+    def moved(self, world):
+        """
+        Counts moves and deaths, called after the move phase while the rows
+        still match those of begin()
+        """
+        agents = world.agents
+        n = len(self.x_before)
+        moved = (agents.x[:n] != self.x_before) | (agents.y[:n] != self.y_before)
+        self.record["moves"] = int(np.count_nonzero(moved))
+        self.record["deaths"] = int(np.count_nonzero(~agents.alive[:n]))
+
+    def rendered(self, sink):
+        self.record["cells_repainted"] = getattr(sink, "num_repainted", 0)
+
+    def end(self, world):
+        record = self.record
+        record["tick"] = world.tick
+        record["population"] = world.agents.count
+        record["total_seconds"] = time.perf_counter() - self.start
+
+        self.history.append(record)
+        if self.stream is not None:
+            self.write(record)
+        self.record = None
+
+    def write(self, record):
+        if self.format == "json":
+            self.stream.write(json.dumps(record) + "\n")
+            return
+
+        if not self.header_written:
+            self.stream.write(",".join(TickStats.FIELDS) + "\n")
+            self.header_written = True
+        self.stream.write(",".join(str(record[name]) for name in TickStats.FIELDS) + "\n")
+
+    def latest(self):
+        return self.history[-1] if self.history else None
+
+    def records(self):
+        return list(self.history)
+
+    def summary(self):
+        """
+        Returns the mean of every field over the kept history
+        """
+        if not self.history:
+            return {}
+        return {name: sum(record[name] for record in self.history) / len(self.history)
+                for name in TickStats.FIELDS if name != "tick"}
+
+    def format_latest(self):
+        """
+        Short multi-line text of the latest record, for an on-screen overlay
+        """
+        record = self.latest()
+        if record is None:
+            return ""
+
+        lines = ["tick %d  %.2f ms" % (record["tick"], 1000*record["total_seconds"])]
+        lines += ["%-12s %7.2f ms" % (phase, 1000*record[phase + "_seconds"]) for phase in TickStats.PHASES]
+        lines += ["%-12s %7d" % (name.replace("cells_", ""), record[name]) for name in TickStats.COUNTERS]
+        return "\n".join(lines)
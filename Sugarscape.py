@@ -1,66 +1,293 @@
-import random as rd
-import tkinter.messagebox as box
 import math as m
-from itertools import product
-import copy
+
+import numpy as np
+
+import Kernels
+
+
+class RenderSink(object):
+    """
+    Interface between the simulation and whatever draws it. The world hands
+    itself to render() once after initialize() and once after every tick;
+    the sink reads the state it needs (get_sugar_grid(), the AgentStore) and
+    is expected to redraw only what changed since the previous call.
+    """
+    def render(self, world):
+        raise NotImplementedError
+
+    def delete(self):
+        raise NotImplementedError
+
+
+class NullSink(RenderSink):
+    """
+    Sink that discards every frame, used for headless runs
+    """
+    def render(self, world):
+        pass
+
+    def delete(self):
+        pass
 
 
 class World(object):
-    def __init__(self, canvas, width, height, grid_size, pop, radius):
-        self.canvas = canvas
+    EMPTY = -1
+
+    def __init__(self, canvas=None, width=700, height=700, grid_size=50, pop=200, radius=250, peaks=None,
+                 region=None, on_sugar=False, regrowth="eager", max_vision=None, max_metabolism=None, seed=None,
+                 update="sequential", workers=1, tile_size=None):
+        self.canvas = canvas if canvas is not None else NullSink()
         self.width = width
         self.height = height
         self.grid_size = grid_size
         self.radius = radius
+        self.peaks = peaks
+
+        self.region = region
+        self.on_sugar = on_sugar
+        # placement and movement draw from independent substreams of the seed,
+        # so a change in how one of them draws leaves the other untouched
+        self.seed_sequence = np.random.SeedSequence(seed)
+        placement_seed, movement_seed = self.seed_sequence.spawn(2)
+        self.rng = np.random.default_rng(placement_seed)
+        self.move_rng = np.random.default_rng(movement_seed)
+
+        self.max_vision = max_vision if max_vision is not None else Agent.MAX_VISION
+        self.max_metabolism = max_metabolism if max_metabolism is not None else Agent.MAX_METABOLISM
+
+        if regrowth not in ("eager", "lazy"):
+            raise ValueError("Unknown regrowth mode: " + str(regrowth))
+        self.regrowth = regrowth
+
+        if update not in UPDATE_RULES:
+            raise ValueError("Unknown update mode: " + str(update))
+        self.update = update
+        # above one, ticks are split across that many processes by a Domain,
+        # which holds a process pool and shared memory until close(); use the
+        # world in a with statement to have it closed
+        self.workers = workers
+        # None keeps dense grids; otherwise the landscape and the occupancy
+        # grid are TiledGrids of tile_size*tile_size cells allocated on demand
+        if tile_size is not None and (regrowth != "eager" or workers > 1):
+            raise ValueError("Tiled grids need eager regrowth and a single worker")
+        self.tile_size = tile_size
+        self.domain = None
+        self.tick = 0
+        self.observers = []
+        self.checkpoint_path = None
+        self.checkpoint_every = 0
+        self.checkpoint_compress = False
+        self.stats = None
 
         self.min_gx, self.min_gy = 0, 0
         self.max_gx, self.max_gy = self.grid_size-1, self.grid_size-1
 
         self.dx = width/grid_size
         self.dy = height/grid_size
+        self.tkinter_axes = None
 
         self.agent_pop = pop
 
     def initialize(self):
+        self.neighbors = get_neighbor_table(self.grid_size, self.max_vision)
         self.create_grid()
         self.create_resource()
         self.create_agent()
+        if self.workers > 1:
+            from Domain import Domain
+            self.domain = Domain(self, self.workers)
+        self.render()
 
-    def run(self):
+        for observer in self.observers:
+            observer.on_initialize(self)
 
-        for res in self.non_zero_resources:
-            sugar_lvl = res.get_sugar_level()
-            capacity = res.get_capacity()
+    def add_observer(self, observer):
+        """
+        Registers an object with on_initialize(world) and on_tick(world, events)
+        methods, e.g. a Metrics.MetricsCollector. on_tick receives the tick's
+        TickEvents before dead agents are compacted away.
+        """
+        self.observers.append(observer)
 
-            if sugar_lvl <= capacity:
-                res.grow()
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
 
-        for agent in self.agent_list:
-            if agent.is_alive():
-                agent.execute()
-            else:
-                agent.remove()
+    def run(self, render=True):
+        """
+        Advances the world by one tick; render=False skips drawing so callers
+        can draw only every few ticks.
+        With stats enabled every phase is timed; otherwise the only cost is
+        checking for them
+        """
+        stats = self.stats
+        if stats is not None:
+            stats.begin(self)
+
+        self.tick += 1
+        move_agents = self.move_agents
+        if self.domain is not None:
+            self.domain.grow(self.tick)
+            move_agents = self.domain.move_agents
+        else:
+            self.landscape.grow(self.tick)
+        if stats is not None:
+            stats.mark("grow")
+
+        events = TickEvents(self) if self.observers else None
+        if stats is not None:
+            stats.mark("observers")
+
+        move_agents()
+        if stats is not None:
+            stats.mark("move")
+            stats.moved(self)
+
+        if events is not None:
+            events.finish()
+            for observer in self.observers:
+                observer.on_tick(self, events)
+        if stats is not None:
+            stats.mark("observers")
+
+        if self.agents.compact():
+            self.update_occupancy()
+        if self.tile_size is not None:
+            self.release_tiles()
+        if stats is not None:
+            stats.mark("compact")
+
+        if self.checkpoint_every and self.tick % self.checkpoint_every == 0:
+            path = self.checkpoint_path % self.tick if "%" in self.checkpoint_path else self.checkpoint_path
+            self.save(path, self.checkpoint_compress)
+        if stats is not None:
+            stats.mark("checkpoint")
+
+        if render:
+            self.render()
+        if stats is not None:
+            stats.mark("render")
+            if render:
+                stats.rendered(self.canvas)
+            stats.end(self)
+
+    def render(self):
+        self.canvas.render(self)
+
+    def save(self, path, compress=False):
+        """
+        Writes the full state of the world, see Checkpoint.save_world
+        """
+        from Checkpoint import save_world
+        save_world(self, path, compress)
 
-    def create_grid(self):
+    @staticmethod
+    def load(path, canvas=None, mmap=True):
+        """
+        Returns the world saved at path, see Checkpoint.load_world
+        """
+        from Checkpoint import load_world
+        return load_world(path, canvas, mmap)
+
+    def enable_stats(self, history=1000, stream=None, format="csv"):
+        """
+        Starts timing the phases of every tick and returns the
+        Stats.TickStats collecting them
         """
-        -Creates grid coordinates (maps cartesian coordinates with tkinter coordinates)
-        -Creates grid_occupancy to check if the grid is occupied by an agent, value is False
-         if empty and True if occupied
+        from Stats import TickStats
+        self.stats = TickStats(history, stream, format)
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
+
+    def checkpoint(self, path, every, compress=False):
+        """
+        Saves the world every few ticks; a %d in path is replaced by the tick
+        to keep every checkpoint, otherwise the last one is overwritten.
+        every=0 stops checkpointing
+        """
+        self.checkpoint_path = path
+        self.checkpoint_every = every
+        self.checkpoint_compress = compress
+
+    def close(self):
+        """
+        Stops the worker processes of a multi-core world; the world stays
+        usable and runs serially afterwards
         """
-        self.grid_occupancy = {}
-        self.coords_map = {}
+        if self.domain is not None:
+            self.domain.close()
+            self.domain = None
 
-        tk_x = 0
-        for x in range(self.grid_size):
-            tk_y = 0
-            for y in range(self.grid_size):
-                self.grid_occupancy[(x, y)] = False
-                self.coords_map[(x, y)] = (tk_x, tk_y)
+    def __enter__(self):
+        return self
 
-                tk_y += self.dy
-            tk_x += self.dx
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def move_agents(self):
+        """
+        Moves and feeds every agent with the rule of UPDATE_RULES[self.update]
+        """
+        UPDATE_RULES[self.update](self.agents, np.arange(self.agents.count), self.landscape,
+                                  self.grid_occupancy.reshape(-1), self.neighbors, self.move_rng)
+
+    def create_grid(self):
+        """
+        -Creates grid_occupancy, a grid holding the AgentStore row of the agent
+         in each cell, or EMPTY if the cell is free; dense, or tiled when the
+         world has a tile_size
+        """
+        if self.tile_size is not None:
+            self.grid_occupancy = TiledGrid(self.grid_size, self.tile_size, np.int32, World.EMPTY)
+            return
+        self.grid_occupancy = np.full((self.grid_size, self.grid_size), World.EMPTY, dtype=np.int32)
 
     def create_resource(self):
+        '''
+        Sets the capacity of every cell to the highest capacity any sugar
+        peak gives it, and fills every cell up to its capacity.
+        Peaks are (x, y, max_dist) tuples in tkinter coordinates; when the
+        world was built without peaks the default_peaks pattern is used.
+        A tiled world only computes the tiles within reach of a peak and only
+        allocates those that get some capacity
+        :return:
+        '''
+        self.pos = self.peaks if self.peaks is not None else self.default_peaks()
+        tk_xs, tk_ys = self.get_tkinter_axes()
+
+        if self.tile_size is not None:
+            self.landscape = TiledLandscape(self.grid_size, self.tile_size)
+            for xs, ys in self.get_peak_tiles(tk_xs, tk_ys):
+                capacity = peak_capacity(tk_xs[xs][:, None], tk_ys[ys][None, :], self.pos)
+                if capacity.any():
+                    self.landscape.set_capacity(xs[:, None], ys[None, :], capacity)
+            return
+
+        self.landscape = Landscape(self.grid_size) if self.regrowth == "eager" else LazyLandscape(self.grid_size)
+        capacity = peak_capacity(tk_xs[:, None], tk_ys[None, :], self.pos)
+
+        self.landscape.capacity[:] = capacity
+        self.landscape.sugar_level[:] = capacity
+
+    def get_peak_tiles(self, tk_xs, tk_ys):
+        """
+        Returns the grid columns and rows of every tile that overlaps the
+        bounding box of a peak, in tile order. A cell farther than max_dist
+        from every peak has no capacity, so the other tiles stay empty
+        """
+        size = self.tile_size
+        tiles = set()
+        for pos_tx, pos_ty, max_dist in self.pos:
+            tiles_x = np.unique(np.flatnonzero(np.abs(tk_xs - pos_tx) <= max_dist) // size)
+            tiles_y = np.unique(np.flatnonzero(np.abs(tk_ys - pos_ty) <= max_dist) // size)
+            tiles.update((int(tx), int(ty)) for tx in tiles_x for ty in tiles_y)
+
+        for tx, ty in sorted(tiles):
+            yield (np.arange(tx*size, min((tx+1)*size, self.grid_size)),
+                   np.arange(ty*size, min((ty+1)*size, self.grid_size)))
+
+    def default_peaks(self):
         '''
         Creates a pattern for resource distribution in north-east
         and south-west quadrant of grid
@@ -71,22 +298,9 @@ class World(object):
         3. Find mid-point on SE quadrant between mid and SW coordinates
         4. Calculate max distance for NE and SW
         5. Create a tuple with (x, y, dist) for NE and SW
-        6. Iterate through grid coordinates to set sugar level in grid
-        :return:
+        :return: list of peaks
         '''
 
-        #sugar_colors = {1: "#FFFFCC", 2: "#FFFFCC",
-                        #3: "#FFFF99", 4: "#FFFF99",
-                        #5: "#FFFF66", 6: "#FFFF66",
-                        #7: "#FFFF33", 8: "#FFFF33",
-                        #9: "#FFFF00", 10: "#FFFF00"}
-
-        sugar_colors = {1: "#FF6666", 2: "#FF6666",
-                        3: "#FF3333", 4: "#FF3333",
-                        5: "#FF0000", 6: "#FF0000",
-                        7: "#CC0000", 8: "#CC0000",
-                        9: "#990000", 10: "#990000"}
-
         ne_pos = (self.width, 0)
         sw_pos = (0, self.height)
 
@@ -103,84 +317,95 @@ class World(object):
         north_pos = (north_mid_x, north_mid_y, max_dist_north)
         south_pos = (south_mid_x, south_mid_y, max_dist_south)
 
-        self.pos = [north_pos, south_pos]
-        self.resources = {}
-        self.non_zero_resources = []
-
-        for x, y in product(range(self.grid_size), range(self.grid_size)):
-            self.resources[(x, y)] = 0
-
-        for pos in self.pos:
-            for x, y in product(range(self.grid_size), range(self.grid_size)):
-                idx = "sugar" + str(x*self.grid_size + y)
-                resource = Resource(world=self,
-                                    canvas=self.canvas,
-                                    colors=sugar_colors,
-                                    idx=idx,
-                                    x=x,
-                                    y=y)
-
-                if not self.resources[(x, y)]:
-                    resource.set_capacity(pos)
-                    self.resources[(x, y)] = resource
-                else:
-                    prev_resource = self.resources[(x, y)]
-                    new_resource = Resource(world=self,
-                                            canvas=self.canvas,
-                                            colors=sugar_colors,
-                                            idx=idx,
-                                            x=x,
-                                            y=y)
-                    new_resource.set_capacity(pos)
-
-                    c1 = prev_resource.get_capacity()
-                    c2 = new_resource.get_capacity()
-
-                    if c2 > c1:
-                        resource.set_new_capacity(c2)
-                        self.resources[(x, y)] = resource
-
-                if self.resources[(x, y)].get_capacity() > 0:
-                    self.resources[(x, y)].draw()
-
-        for key in self.resources:
-            if self.resources[key].capacity > 0:
-                self.non_zero_resources.append(self.resources[key])
-
+        return [north_pos, south_pos]
 
     def create_agent(self):
-        self.agent_list = []
-        if self.agent_pop > self.grid_size*self.grid_size:
-            box.showerror("Error", "Agent population exceeds world size")
-        else:
-            idx = 0
-            while idx < self.agent_pop:
-                x = rd.randint(0, self.grid_size-1)
-                y = rd.randint(0, self.grid_size-1)
+        """
+        Places agent_pop agents on distinct cells drawn without replacement,
+        so placement cost does not depend on how full the world is.
+        -region (x_min, y_min, x_max, y_max), inclusive grid coordinates,
+         restricts placement to a rectangle
+        -on_sugar restricts placement to cells with non-zero capacity
+        """
+        pop = self.agent_pop
+        self.agents = AgentStore(pop)
 
-                if not self.is_occupied(x, y):
-                    agent = Agent(self,
-                                  self.canvas,
-                                  idx="agent" + str(idx),
-                                  x=x,
-                                  y=y,
-                                  color="#000066")
+        cells = self.get_placement_cells()
+        if cells is None and pop > self.grid_size*self.grid_size:
+            raise ValueError("Agent population exceeds world size")
+        if cells is not None and pop > len(cells):
+            raise ValueError("Agent population exceeds the cells available for placement")
 
-                    agent.draw()
+        if cells is None:
+            chosen = self.rng.choice(self.grid_size*self.grid_size, size=pop, replace=False)
+        else:
+            chosen = self.rng.choice(cells, size=pop, replace=False)
+        x, y = np.divmod(chosen, self.grid_size)
 
-                    self.agent_list.append(agent)
-                    self.add_occupancy(x, y)
+        vision = self.rng.integers(1, self.max_vision, size=pop, endpoint=True)
+        metabolism = self.rng.integers(1, self.max_metabolism, size=pop, endpoint=True)
+        wealth = self.rng.integers(Agent.MIN_SUGAR, Agent.MAX_SUGAR, size=pop, endpoint=True)
 
-                    idx += 1
+        rows = self.agents.add_many(x, y, vision, metabolism, wealth)
+        self.grid_occupancy[x, y] = rows
+
+    def get_placement_cells(self):
+        """
+        Returns the flat indices of the cells agents may be placed on, or None
+        when every cell is allowed
+        """
+        if self.region is None and not self.on_sugar:
+            return None
+        if self.region is None:
+            return self.landscape.capacity_cells()
+
+        # a region wider than the grid wraps onto itself; its first grid_size
+        # columns (rows) already cover every one of them once
+        x_min, y_min, x_max, y_max = self.region
+        xs = (np.arange(x_min, x_max + 1) % self.grid_size)[:self.grid_size]
+        ys = (np.arange(y_min, y_max + 1) % self.grid_size)[:self.grid_size]
+        cells = (xs[:, None]*self.grid_size + ys).ravel()
+
+        if self.on_sugar:
+            cells = cells[self.landscape.get_capacity(*np.divmod(cells, self.grid_size)) > 0]
+        return cells
 
     def is_occupied(self, x, y):
-        return self.grid_occupancy[(x, y)]
+        return bool(self.grid_occupancy[x, y] != World.EMPTY)
+
+    def are_occupied(self, x, y):
+        """
+        Vectorized is_occupied for arrays of coordinates
+        """
+        return self.grid_occupancy[x, y] != World.EMPTY
+
+    def get_occupant(self, x, y):
+        """
+        Returns the AgentStore row of the agent at (x, y), or EMPTY
+        """
+        return int(self.grid_occupancy[x, y])
 
-    def add_occupancy(self, x, y):
-        self.grid_occupancy[(x, y)] = True
+    def add_occupancy(self, x, y, row):
+        self.grid_occupancy[x, y] = row
 
     def remove_occupancy(self, x, y):
-        self.grid_occupancy[(x, y)] = False
+        self.grid_occupancy[x, y] = World.EMPTY
+
+    def update_occupancy(self):
+        """
+        Rewrites the occupant of every agent's cell after the AgentStore has
+        been compacted and its rows renumbered
+        """
+        n = self.agents.count
+        self.grid_occupancy[self.agents.x[:n], self.agents.y[:n]] = np.arange(n, dtype=np.int32)
+
+    def release_tiles(self):
+        """
+        Frees the occupancy tiles no agent stands in any more: a tile without
+        agents only holds EMPTY, so occupancy memory follows the agents
+        """
+        n = self.agents.count
+        self.grid_occupancy.retain(self.agents.x[:n] // self.tile_size, self.agents.y[:n] // self.tile_size)
 
     def mid_point(self, pos1, pos2):
         mid = ((pos1[0] + pos2[0]) / 2, (pos1[1] + pos2[1]) / 2)
@@ -189,9 +414,22 @@ class World(object):
     def distance(self, x, y):
         return m.sqrt(x*x + y*y)
 
+    def get_tkinter_axes(self):
+        """
+        Returns the tkinter x coordinate of every grid column and the y
+        coordinate of every grid row, accumulated one cell at a time. The
+        axes are computed once per world and shared, so callers must not
+        modify them
+        """
+        if self.tkinter_axes is None:
+            tk_xs = np.concatenate(([0.0], np.cumsum(np.full(self.grid_size-1, self.dx))))
+            tk_ys = np.concatenate(([0.0], np.cumsum(np.full(self.grid_size-1, self.dy))))
+            self.tkinter_axes = tk_xs, tk_ys
+        return self.tkinter_axes
+
     def get_xy_tkinter(self, x, y):
-        coords = self.coords_map[(x, y)]
-        return coords[0], coords[1]
+        tk_xs, tk_ys = self.get_tkinter_axes()
+        return float(tk_xs[x]), float(tk_ys[y])
 
     def get_min_grid_xy(self):
         return self.min_gx, self.min_gy
@@ -214,210 +452,803 @@ class World(object):
     def get_grid_size(self):
         return self.grid_size
 
+    def get_seed(self):
+        """
+        Returns the entropy the world's generators were seeded with; passing it
+        as seed rebuilds the same world, also for worlds created unseeded
+        """
+        return self.seed_sequence.entropy
+
+    def spawn_rng(self):
+        """
+        Returns a new generator on a substream independent of every other one
+        spawned from this world's seed, for extensions that need randomness
+        """
+        return np.random.default_rng(self.seed_sequence.spawn(1)[0])
+
     def get_resource(self, x, y):
-        return self.resources[(x, y)]
+        return Resource(self, x, y)
 
     def get_agent_count(self):
-        return len(self.agent_list)
+        return self.agents.count
+
+    def get_average_wealth(self):
+        return self.get_average(self.agents.wealth)
+
+    def get_average_vision(self):
+        return self.get_average(self.agents.vision)
+
+    def get_average_metabolism(self):
+        return self.get_average(self.agents.metabolism)
+
+    def get_average(self, column):
+        if self.agents.count == 0:
+            return 0.0
+        return float(column[:self.agents.count].mean())
+
+
+def move_rows(agents, rows, landscape, occupancy, neighbors, rng):
+    """
+    Sequential movement rule: moves each of the given AgentStore rows, in
+    order, to the unoccupied cell with the most sugar in its vision and
+    lets it eat there.
+    Steps:
+    1. Gather the sugar along the vision rays of all agents at once
+    2. Rank each agent's cells by sugar, breaking ties with random keys
+    3. Walk agents in order and take the first ranked cell that is still
+       free and not yet eaten this tick; stay put if there is none
+    4. Eat, and free the cell immediately if the agent starves
+    5. Harvest every eaten cell in one batch
+    Sugar only changes during the walk when a cell is eaten, so a ranked
+    cell that has not been eaten still holds its gathered sugar and the
+    landscape is only read once and written once per tick.
+    occupancy is the flat occupancy grid; cells outside the reach of these
+    rows are neither read nor written, which is what lets Domain run
+    disjoint groups of rows in parallel.
+    The walk over the agents runs in Kernels.sequential_moves, compiled,
+    when numba is installed and in move_rows_python otherwise; both give
+    the same trajectory. A tiled occupancy grid is copied into a dense
+    window of the cells the walk can reach and written back after it.
+    """
+    grid_size = neighbors.grid_size
+    n = len(rows)
+
+    old_x, old_y = agents.x[rows], agents.y[rows]
+    cells_x, cells_y = neighbors.cells(old_x, old_y)
+    visible = neighbors.dist <= agents.vision[rows, None]
+
+    sugar = landscape.get_sugar(cells_x, cells_y)
+    score = np.where(visible & (sugar > 0), sugar + rng.random(sugar.shape), -1.0)
+
+    order = np.argsort(-score, axis=1)
+    num_ranked = np.count_nonzero(score > 0, axis=1)
+    ranked_cells = np.take_along_axis(cells_x.astype(np.int64)*grid_size + cells_y, order, axis=1)
+    ranked_sugar = np.take_along_axis(sugar, order, axis=1)
+
+    own_cells = old_x.astype(np.int64)*grid_size + old_y
+    own_sugar = landscape.get_sugar(old_x, old_y)
+    wealth = agents.wealth[rows].astype(np.int64)
+    metabolism = agents.metabolism[rows]
+
+    window = None
+    if not isinstance(occupancy, np.ndarray):
+        grid = occupancy
+        window, inverse = np.unique(np.concatenate((ranked_cells.ravel(), own_cells)), return_inverse=True)
+        occupancy = grid[window]
+        ranked_cells = inverse[:ranked_cells.size].reshape(ranked_cells.shape)
+        own_cells = inverse[ranked_cells.size:]
+
+    if Kernels.enabled:
+        dead = np.zeros(n, dtype=bool)
+        Kernels.sequential_moves(ranked_cells, ranked_sugar, num_ranked, own_cells, own_sugar, wealth,
+                                 metabolism, rows.astype(np.int64), occupancy, World.EMPTY, dead)
+        occupancy[own_cells[dead]] = World.EMPTY
+        agents.alive[rows[dead]] = False
+    else:
+        own_cells, wealth = move_rows_python(agents, rows, ranked_cells, ranked_sugar, num_ranked, own_cells,
+                                             own_sugar, wealth, metabolism, occupancy)
+
+    if window is not None:
+        grid[window] = occupancy
+        own_cells = window[own_cells]
+
+    xs, ys = np.divmod(own_cells, grid_size)
+    agents.x[rows], agents.y[rows] = xs, ys
+    agents.wealth[rows] = wealth
+
+    # every agent ate the cell it ended on
+    landscape.set_sugar(xs, ys, 0)
+
+
+def move_rows_python(agents, rows, ranked_cells, ranked_sugar, num_ranked, own_cells, own_sugar, wealth,
+                     metabolism, occupancy):
+    """
+    The walk of move_rows in plain Python, used when the compiled kernel of
+    Kernels is not available. Returns the final cells and wealth as arrays
+    """
+    n = len(rows)
+    num_ranked = num_ranked.tolist()
+    ranked_cells = ranked_cells.tolist()
+    ranked_sugar = ranked_sugar.tolist()
+    own_cells = own_cells.tolist()
+    own_sugar = own_sugar.tolist()
+    wealth = wealth.tolist()
+    metabolism = metabolism.tolist()
+    row_ids = rows.tolist()
+
+    eaten = set()
+    for i in range(n):
+        cell, gain = own_cells[i], own_sugar[i]
+        for k in range(num_ranked[i]):
+            target = ranked_cells[i][k]
+            if occupancy[target] == World.EMPTY and target not in eaten:
+                occupancy[cell] = World.EMPTY
+                occupancy[target] = row_ids[i]
+                cell, gain = target, ranked_sugar[i][k]
+                break
+
+        own_cells[i] = cell
+        eaten.add(cell)
+        wealth[i] += gain - metabolism[i]
+
+        if wealth[i] < 0:
+            agents.kill(row_ids[i])
+            occupancy[cell] = World.EMPTY
+
+    return np.array(own_cells, dtype=np.int64), np.array(wealth, dtype=np.int64)
+
+
+def move_synchronous(agents, rows, landscape, occupancy, neighbors, rng):
+    """
+    Synchronous alternative to move_rows: every agent proposes a cell from
+    the same snapshot of the landscape and of the occupancy grid, and
+    contested cells go to the proposer with the highest random priority.
+    Steps:
+    1. Rank each agent's cells by sugar, breaking ties with random keys;
+       cells occupied at the start of the tick are never available, even if
+       their occupant leaves
+    2. Every unresolved agent proposes its best ranked cell not yet claimed,
+       or stays put when none is left
+    3. The highest priority proposer of each cell claims it, the others
+       stay unresolved and propose again
+    4. Repeat until every agent is resolved, then eat and starve in one batch
+    Each round resolves at least one agent per contested cell, and all the
+    work of a round is array operations over the unresolved agents.
+    """
+    grid_size = neighbors.grid_size
+    n = len(rows)
+
+    old_x, old_y = agents.x[rows], agents.y[rows]
+    cells_x, cells_y = neighbors.cells(old_x, old_y)
+    visible = neighbors.dist <= agents.vision[rows, None]
+
+    sugar = landscape.get_sugar(cells_x, cells_y)
+    score = np.where(visible & (sugar > 0), sugar + rng.random(sugar.shape), -1.0)
+    priority = rng.random(n)
+
+    order = np.argsort(-score, axis=1)
+    ranked_cells = np.take_along_axis(cells_x.astype(np.int64)*grid_size + cells_y, order, axis=1)
+    ranked_sugar = np.take_along_axis(sugar, order, axis=1)
+    available = (np.take_along_axis(score, order, axis=1) > 0) & (occupancy[ranked_cells] == World.EMPTY)
+
+    own_cells = old_x.astype(np.int64)*grid_size + old_y
+    cells = own_cells.copy()
+    gain = landscape.get_sugar(old_x, old_y).astype(np.int64)
+
+    if isinstance(occupancy, np.ndarray):
+        claimed = np.zeros(grid_size*grid_size, dtype=bool)
+    else:
+        claimed = TiledGrid(grid_size, occupancy.grid.tile_size, bool, False).reshape(-1)
+    pending = np.arange(n)
+    while len(pending):
+        candidates = available[pending] & ~claimed[ranked_cells[pending]]
+        choice = candidates.argmax(axis=1)
+        proposes = candidates[np.arange(len(pending)), choice]
+
+        # agents with nothing left to propose stay where they are
+        pending, choice = pending[proposes], choice[proposes]
+        targets = ranked_cells[pending, choice]
+
+        by_priority = np.argsort(-priority[pending], kind="stable")
+        _, first = np.unique(targets[by_priority], return_index=True)
+        won = by_priority[first]
+
+        winners = pending[won]
+        cells[winners] = targets[won]
+        gain[winners] = ranked_sugar[winners, choice[won]]
+        claimed[targets[won]] = True
+
+        lost = np.ones(len(pending), dtype=bool)
+        lost[won] = False
+        pending = pending[lost]
+
+    wealth = agents.wealth[rows] + gain - agents.metabolism[rows]
+    dead = wealth < 0
+
+    occupancy[own_cells] = World.EMPTY
+    occupancy[cells[~dead]] = rows[~dead]
+
+    agents.x[rows], agents.y[rows] = np.divmod(cells, grid_size)
+    agents.wealth[rows] = wealth
+    agents.alive[rows[dead]] = False
+
+    eaten_x, eaten_y = np.divmod(cells, grid_size)
+    landscape.set_sugar(eaten_x, eaten_y, 0)
+
+
+# movement kernels by World update mode, all with the same signature
+UPDATE_RULES = {"sequential": move_rows, "synchronous": move_synchronous}
+
+
+class TickEvents(object):
+    """
+    What happened to the agents during one tick, row by row over the rows
+    the tick started with:
+    -wealth_before and wealth hold the wealth before and after the tick
+    -harvest holds the sugar each agent ate
+    -moved flags agents that changed cell, dead agents that starved
+    vision and metabolism are views of the AgentStore, valid until the world
+    compacts it at the end of the tick.
+    """
+    def __init__(self, world):
+        agents = world.agents
+        self.world = world
+        self.tick = world.tick
+        self.count = agents.count
+
+        self.wealth_before = agents.wealth[:self.count].copy()
+        self.x_before = agents.x[:self.count].copy()
+        self.y_before = agents.y[:self.count].copy()
+
+    def finish(self):
+        agents = self.world.agents
+        n = self.count
+
+        self.wealth = agents.wealth[:n]
+        self.vision = agents.vision[:n]
+        self.metabolism = agents.metabolism[:n]
+        self.dead = ~agents.alive[:n]
+        self.moved = (agents.x[:n] != self.x_before) | (agents.y[:n] != self.y_before)
+        self.harvest = self.wealth - self.wealth_before + self.metabolism
+
+
+class NeighborTable(object):
+    """
+    Wraparound lookup tables for the vision rays on a torus of grid_size
+    cells, shared by every rule that needs an agent's neighborhood.
+    -columns run ray by ray over Agent.MOVEMENT, max_vision cells per ray
+    -dist holds the distance of each column from the agent, so a query for
+     vision v keeps the columns with dist <= v
+    -wrap_x[k, x] and wrap_y[k, y] hold the wrapped coordinates of column k
+     seen from x and y, so a lookup needs no modulo arithmetic
+    Tables only depend on grid_size and max_vision; use get_neighbor_table
+    to share one instance per size.
+    """
+    def __init__(self, grid_size, max_vision):
+        self.grid_size = grid_size
+        self.max_vision = max_vision
 
+        steps = np.arange(1, max_vision + 1)
+        movement = np.array(Agent.MOVEMENT)
 
-class Resource(object):
-    MAX_CAPACITY = 10
-    GROWTH_RATE = 3
+        self.offset_x = (movement[:, 0:1] * steps).ravel()
+        self.offset_y = (movement[:, 1:2] * steps).ravel()
+        self.dist = np.tile(steps, len(Agent.MOVEMENT))
 
-    def __init__(self, world, canvas, colors, idx, x, y):
-        self.idx = idx
-        self.world = world
-        self.canvas = canvas
-        self.colors = colors
+        coords = np.arange(grid_size)
+        self.wrap_x = ((coords + self.offset_x[:, None]) % grid_size).astype(np.int32)
+        self.wrap_y = ((coords + self.offset_y[:, None]) % grid_size).astype(np.int32)
 
-        self.x, self.y = x, y
-        self.tk_x, self.tk_y = self.world.get_xy_tkinter(x, y)
+    def columns(self, vision):
+        return np.flatnonzero(self.dist <= vision)
 
-        self.capacity = 0
-        self.sugar_level = 0
+    def cells(self, x, y):
+        """
+        Returns the x and y coordinates of every column for each agent, one
+        row per entry of x and y
+        """
+        return self.wrap_x[:, x].T, self.wrap_y[:, y].T
 
-    def grow(self):
-        if self.sugar_level < self.capacity:
-            self.sugar_level += Resource.GROWTH_RATE
+    def flat_cells(self, x, y):
+        cells_x, cells_y = self.cells(x, y)
+        return cells_x.astype(np.int64)*self.grid_size + cells_y
 
-        if self.sugar_level > self.capacity:
-            self.sugar_level = self.capacity
-        #self.sugar_level = self.capacity
 
-        if self.sugar_level > 0:
-            self.canvas.update_rectangle(self.idx, self.colors[self.sugar_level])
-            # self.draw()
+NEIGHBOR_TABLES = {}
 
-    def set_capacity(self, ref_pos):
-        pos_tx, pos_ty, max_dist = ref_pos[0], ref_pos[1], ref_pos[2]
-        dist = self.world.distance(pos_tx-self.tk_x, pos_ty-self.tk_y)
 
-        capacity = 1 + Resource.MAX_CAPACITY * (1 - dist/max_dist)
-        if capacity < 0:
-            self.capacity = 0
-        else:
-            self.capacity = int(min(capacity, Resource.MAX_CAPACITY))
-            self.sugar_level = copy.copy(self.capacity)
+def get_neighbor_table(grid_size, max_vision):
+    key = (grid_size, max_vision)
+    if key not in NEIGHBOR_TABLES:
+        NEIGHBOR_TABLES[key] = NeighborTable(grid_size, max_vision)
+    return NEIGHBOR_TABLES[key]
 
-    def set_new_capacity(self, c):
-        self.capacity = c
-        self.sugar_level = copy.copy(self.capacity)
 
-    def set_sugar_level(self, sugar):
-        self.sugar_level = sugar
+def peak_capacity(tk_x, tk_y, peaks):
+    """
+    Capacity of the cells at tkinter coordinates tk_x, tk_y (any broadcastable
+    arrays). Each peak gives 1 + MAX_CAPACITY*(1 - dist/max_dist), clipped to
+    [0, MAX_CAPACITY] and truncated to an integer; a cell keeps the highest
+    value over all peaks
+    """
+    shape = np.broadcast(tk_x, tk_y).shape
+    capacity = np.zeros(shape, dtype=np.int32)
 
-    def get_capacity(self):
-        return self.capacity
+    for pos_tx, pos_ty, max_dist in peaks:
+        dist_x, dist_y = pos_tx - tk_x, pos_ty - tk_y
+        dist = np.sqrt(dist_x*dist_x + dist_y*dist_y)
 
-    def get_sugar_level(self):
-        return self.sugar_level
+        peak = 1 + Resource.MAX_CAPACITY * (1 - dist/max_dist)
+        np.maximum(capacity, np.clip(peak, 0, Resource.MAX_CAPACITY).astype(np.int32), out=capacity)
 
-    def getX(self):
-        return self.x
+    return capacity
 
-    def getY(self):
-        return self.y
 
-    def draw(self):
+class Landscape(object):
+    """
+    Sugar landscape stored as two contiguous grids indexed [x, y]:
+    -capacity holds the maximum sugar of each cell
+    -sugar_level holds the sugar currently available in each cell
+    """
+    def __init__(self, grid_size):
+        self.grid_size = grid_size
+        self.tick = 0
+        self.capacity = np.zeros((grid_size, grid_size), dtype=np.int32)
+        self.sugar_level = np.zeros((grid_size, grid_size), dtype=np.int32)
 
-        xmin, ymin = self.tk_x, self.tk_y
-        xmax, ymax = xmin + self.world.get_dx(), ymin + self.world.get_dy()
+    def grow(self, tick):
+        self.tick = tick
+        np.minimum(self.sugar_level + Resource.GROWTH_RATE, self.capacity, out=self.sugar_level)
 
-        self.canvas.create_rectangle(x_min=xmin,
-                                     y_min=ymin,
-                                     x_max=xmax,
-                                     y_max=ymax,
-                                     color=self.colors[self.sugar_level],
-                                     tag=self.idx)
+    def get_sugar(self, x, y):
+        return self.sugar_level[x, y]
 
+    def set_sugar(self, x, y, sugar):
+        self.sugar_level[x, y] = sugar
 
-class Agent(object):
-    MAX_VISION = 6
-    MAX_METABOLISM = 6
-    MIN_SUGAR, MAX_SUGAR = 5, 25
-    MOVEMENT = [(-1, 0), (1, 0), (0, 1), (0, -1)]
+    def set_capacity(self, x, y, capacity):
+        self.capacity[x, y] = capacity
+        self.set_sugar(x, y, capacity)
 
-    def __init__(self, world, canvas, idx, x, y,  color):
-        self.world = world
-        self.canvas = canvas
+    def get_sugar_grid(self):
+        return self.sugar_level
+
+    def get_capacity(self, x, y):
+        return self.capacity[x, y]
 
-        self.idx = idx
+    def capacity_cells(self):
+        """
+        Returns the flat indices of the cells with non-zero capacity, in order
+        """
+        return np.flatnonzero(self.capacity)
+
+    def count_below_capacity(self):
+        return int(np.count_nonzero(self.get_sugar_grid() < self.capacity))
+
+
+class LazyLandscape(Landscape):
+    """
+    Landscape that regrows cells when they are read instead of every tick.
+    -sugar_level holds the sugar a cell was last set to
+    -set_tick holds the tick it was set on
+    A cell then holds min(capacity, sugar_level + GROWTH_RATE*(tick - set_tick)),
+    which is exactly what repeated eager grow() calls give, so a tick only
+    costs as much as the cells harvested in it.
+    """
+    def __init__(self, grid_size):
+        Landscape.__init__(self, grid_size)
+        self.set_tick = np.zeros((grid_size, grid_size), dtype=np.int64)
+
+    def grow(self, tick):
+        self.tick = tick
+
+    def get_sugar(self, x, y):
+        return self.regrown(self.sugar_level[x, y], self.capacity[x, y], self.set_tick[x, y])
+
+    def set_sugar(self, x, y, sugar):
+        self.sugar_level[x, y] = sugar
+        self.set_tick[x, y] = self.tick
+
+    def get_sugar_grid(self):
+        return self.regrown(self.sugar_level, self.capacity, self.set_tick)
+
+    def regrown(self, sugar_level, capacity, set_tick):
+        elapsed = self.tick - set_tick
+        grown = np.minimum(sugar_level + Resource.GROWTH_RATE*elapsed, capacity)
+        return np.where(elapsed > 0, grown, sugar_level).astype(np.int32)
+
+
+class TiledGrid(object):
+    """
+    grid_size*grid_size grid stored as square tiles of tile_size cells a
+    side, a tile only being allocated when one of its cells is set to
+    something other than fill, and freed again by retain().
+    -directory[tx, ty] holds the slot of tile (tx, ty) in tiles, or -1 when
+     it was never allocated and all its cells read as fill
+    -tiles holds num_tiles allocated tiles, plus spare slots to grow into
+    Indexing with [x, y] takes ints or broadcastable arrays like the dense
+    grids, reshape(-1) gives the flat view the movement rules index, and
+    np.asarray() gives the dense grid, for the renderers.
+    """
+    def __init__(self, grid_size, tile_size, dtype, fill=0):
+        self.grid_size = grid_size
+        self.tile_size = tile_size
+        self.dtype = np.dtype(dtype)
+        self.fill = fill
+        self.shape = (grid_size, grid_size)
+
+        num = -(-grid_size // tile_size)
+        self.directory = np.full((num, num), -1, dtype=np.int32)
+        self.tiles = np.full((1, tile_size, tile_size), fill, dtype=self.dtype)
+        self.num_tiles = 0
+
+    @staticmethod
+    def from_tiles(grid_size, directory, tiles, fill):
+        """
+        Rebuilds a grid from the directory and the allocated tiles of another
+        """
+        grid = TiledGrid(grid_size, tiles.shape[1], tiles.dtype, fill)
+        grid.directory = np.array(directory, dtype=np.int32)
+        if len(tiles):
+            grid.tiles = tiles
+        grid.num_tiles = len(tiles)
+        return grid
+
+    def __getitem__(self, key):
+        return self.get(*key)
+
+    def __setitem__(self, key, values):
+        self.set(key[0], key[1], values)
+
+    def __array__(self, dtype=None, copy=None):
+        grid = self.dense()
+        return grid if dtype is None else grid.astype(dtype)
+
+    def get(self, x, y):
+        x, y = np.asarray(x), np.asarray(y)
+        size = self.tile_size
+        slot = self.directory[x // size, y // size]
+        values = self.tiles[np.maximum(slot, 0), x % size, y % size]
+        return np.where(slot >= 0, values, self.fill).astype(self.dtype)[()]
+
+    def set(self, x, y, values, allocate=True):
+        """
+        Sets the cells x, y to values. Tiles a non-fill value falls in are
+        allocated first, or with allocate False those values are dropped
+        """
+        x, y, values = np.broadcast_arrays(np.asarray(x), np.asarray(y), np.asarray(values, dtype=self.dtype))
+        size = self.tile_size
+        tile_x, tile_y = x // size, y // size
+        slot = self.directory[tile_x, tile_y]
 
-        self.x = x
-        self.y = y
-        self.color = color
+        if allocate:
+            missing = (slot < 0) & (values != self.fill)
+            if missing.any():
+                self.allocate(tile_x[missing], tile_y[missing])
+                slot = self.directory[tile_x, tile_y]
 
-        self.tk_x, self.tk_y = self.world.get_xy_tkinter(self.x, self.y)
+        kept = slot >= 0
+        self.tiles[slot[kept], x[kept] % size, y[kept] % size] = values[kept]
 
-        self.vision = rd.randint(1, Agent.MAX_VISION)
-        self.metabolism = rd.randint(1, Agent.MAX_METABOLISM)
-        self.wealth = rd.randint(Agent.MIN_SUGAR, Agent.MAX_SUGAR)
+    def allocate(self, tile_x, tile_y):
+        """
+        Allocates the tiles (tile_x, tile_y) that are not allocated yet, in
+        the order of their index, doubling the tile buffer when it is full
+        """
+        num = len(self.directory)
+        index = np.unique(np.asarray(tile_x, dtype=np.int64)*num + tile_y)
+        tile_x, tile_y = np.divmod(index, num)
+        new = self.directory[tile_x, tile_y] < 0
+        tile_x, tile_y = tile_x[new], tile_y[new]
+        if len(tile_x) == 0:
+            return
+
+        needed = self.num_tiles + len(tile_x)
+        if needed > len(self.tiles):
+            tiles = np.full((max(needed, 2*len(self.tiles)), self.tile_size, self.tile_size), self.fill,
+                            dtype=self.dtype)
+            tiles[:self.num_tiles] = self.tiles[:self.num_tiles]
+            self.tiles = tiles
+
+        self.directory[tile_x, tile_y] = np.arange(self.num_tiles, needed)
+        self.num_tiles = needed
+
+    def retain(self, tile_x, tile_y):
+        """
+        Frees every allocated tile but (tile_x, tile_y), which the caller
+        knows to hold only fill, packing the kept ones into the first slots;
+        the buffer shrinks once it is at most a quarter used
+        """
+        keep = np.zeros(self.directory.shape, dtype=bool)
+        keep[tile_x, tile_y] = True
+        keep &= self.directory >= 0
+        num_kept = int(np.count_nonzero(keep))
+        if num_kept == self.num_tiles:
+            return
+
+        kept_x, kept_y = np.nonzero(keep)
+        packed = self.tiles[self.directory[kept_x, kept_y]]
+        self.directory[:] = -1
+        self.directory[kept_x, kept_y] = np.arange(num_kept)
+
+        if 4*num_kept <= len(self.tiles):
+            self.tiles = np.full((max(1, 2*num_kept), self.tile_size, self.tile_size), self.fill, dtype=self.dtype)
+        else:
+            self.tiles[num_kept:self.num_tiles] = self.fill
+        self.tiles[:num_kept] = packed
+        self.num_tiles = num_kept
 
-        self.alive = True
+    def active_tiles(self):
+        return self.tiles[:self.num_tiles]
 
-    def execute(self):
-        if self.alive:
-            self.move()
-            self.eat()
+    def get_num_tiles(self):
+        return self.num_tiles
 
-    def remove(self):
-        self.world.agent_list.remove(self)
-        self.canvas.delete_circle(self.idx)
+    def get_nbytes(self):
+        return self.directory.nbytes + self.tiles.nbytes
 
-    def move(self):
+    def cells(self, slot_mask):
         """
-        Agent searches for location with highest sugar and moves
-        there
-        Steps:
-        1. Get list of surrounding resources covered by agent's vision
-        2. Iterate through neighboring resources to find location with
-        maximum sugar.
-        3. Remove agent from its current location
-        4. Move agent to new location and update it's x, y coordinates
+        Returns the x and y coordinates of the cells of the allocated tiles
+        where slot_mask, a boolean array shaped like active_tiles(), is set
+        """
+        slots, dx, dy = np.nonzero(slot_mask)
+        tile_x, tile_y = np.nonzero(self.directory >= 0)
+        by_slot = np.empty((2, self.num_tiles), dtype=np.int64)
+        by_slot[:, self.directory[tile_x, tile_y]] = tile_x, tile_y
+        return by_slot[0, slots]*self.tile_size + dx, by_slot[1, slots]*self.tile_size + dy
+
+    def dense(self):
+        grid = np.full(self.shape, self.fill, dtype=self.dtype)
+        size = self.tile_size
+        for tile_x, tile_y in zip(*np.nonzero(self.directory >= 0)):
+            x0, y0 = tile_x*size, tile_y*size
+            block = grid[x0:x0 + size, y0:y0 + size]
+            block[:] = self.tiles[self.directory[tile_x, tile_y], :block.shape[0], :block.shape[1]]
+        return grid
+
+    def reshape(self, *shape):
+        if shape not in ((-1,), ((-1,),)):
+            raise ValueError("A TiledGrid can only be reshaped to its flat view")
+        return FlatTiledGrid(self)
+
+
+class FlatTiledGrid(object):
+    """
+    Flat view of a TiledGrid, indexed by x*grid_size + y like a dense grid
+    reshaped to one dimension
+    """
+    def __init__(self, grid):
+        self.grid = grid
+
+    def __getitem__(self, cells):
+        return self.grid.get(*np.divmod(cells, self.grid.grid_size))
+
+    def __setitem__(self, cells, values):
+        x, y = np.divmod(cells, self.grid.grid_size)
+        self.grid.set(x, y, values)
+
+
+class TiledLandscape(Landscape):
+    """
+    Landscape with capacity and sugar_level stored as TiledGrids, for large
+    worlds where most of the torus never holds sugar. A tile is allocated in
+    both grids, at the same slot, when one of its cells gets a capacity, so
+    memory and the cost of grow() scale with the sugar-bearing area instead
+    of the whole grid; cells of the other tiles always read 0.
+    """
+    def __init__(self, grid_size, tile_size):
+        self.grid_size = grid_size
+        self.tick = 0
+        self.capacity = TiledGrid(grid_size, tile_size, np.int32)
+        self.sugar_level = TiledGrid(grid_size, tile_size, np.int32)
+
+    def grow(self, tick):
+        self.tick = tick
+        sugar = self.sugar_level.active_tiles()
+        np.minimum(sugar + Resource.GROWTH_RATE, self.capacity.active_tiles(), out=sugar)
+
+    def get_sugar(self, x, y):
+        return self.sugar_level.get(x, y)
+
+    def set_sugar(self, x, y, sugar):
+        # sugar never exceeds capacity, so a cell of an unallocated tile can
+        # only be set to 0, which it already reads
+        self.sugar_level.set(x, y, sugar, allocate=False)
+
+    def set_capacity(self, x, y, capacity):
+        x, y, capacity = np.broadcast_arrays(np.asarray(x), np.asarray(y), np.asarray(capacity))
+        size = self.capacity.tile_size
+        nonzero = capacity != 0
+        self.capacity.allocate(x[nonzero] // size, y[nonzero] // size)
+        self.sugar_level.allocate(x[nonzero] // size, y[nonzero] // size)
+
+        self.capacity.set(x, y, capacity)
+        self.sugar_level.set(x, y, capacity)
+
+    def get_sugar_grid(self):
         """
+        Returns the dense sugar grid; costs a full grid, so only for renderers
+        and recorders of worlds that fit one
+        """
+        return np.asarray(self.sugar_level)
 
-        max_x, max_y = self.find_xy_max_sugar()
+    def get_capacity(self, x, y):
+        return self.capacity.get(x, y)
 
-        self.world.remove_occupancy(self.x, self.y)
-        self.x, self.y = max_x, max_y
-        self.world.add_occupancy(self.x, self.y)
+    def capacity_cells(self):
+        x, y = self.capacity.cells(self.capacity.active_tiles() > 0)
+        return np.sort(x*self.grid_size + y)
 
-        old_tk_x, old_tk_y = self.tk_x, self.tk_y
-        self.tk_x, self.tk_y = self.world.get_xy_tkinter(self.x, self.y)
+    def count_below_capacity(self):
+        return int(np.count_nonzero(self.sugar_level.active_tiles() < self.capacity.active_tiles()))
 
-        self.canvas.move_circle(self.idx, self.tk_x - old_tk_x, self.tk_y - old_tk_y)
-        self.draw()
+    def get_num_tiles(self):
+        return self.capacity.get_num_tiles()
 
 
-    def eat(self):
-        resource = self.world.resources[(self.x, self.y)]
-        self.wealth += (resource.get_sugar_level() - self.metabolism)
+class Resource(object):
+    """
+    View of a single cell of the world's Landscape
+    """
+    MAX_CAPACITY = 10
+    GROWTH_RATE = 3
 
-        resource.set_sugar_level(0)
+    #COLORS = {1: "#FFFFCC", 2: "#FFFFCC",
+              #3: "#FFFF99", 4: "#FFFF99",
+              #5: "#FFFF66", 6: "#FFFF66",
+              #7: "#FFFF33", 8: "#FFFF33",
+              #9: "#FFFF00", 10: "#FFFF00"}
 
-        if self.wealth < 0:
-            self.alive = False
+    COLORS = {1: "#FF6666", 2: "#FF6666",
+              3: "#FF3333", 4: "#FF3333",
+              5: "#FF0000", 6: "#FF0000",
+              7: "#CC0000", 8: "#CC0000",
+              9: "#990000", 10: "#990000"}
 
-    def find_xy_max_sugar(self):
-        resources = self.get_surrounding_resources()
-        rd.shuffle(resources)
+    def __init__(self, world, x, y):
+        self.world = world
+        self.landscape = world.landscape
 
-        max_sugar = 0
-        max_x, max_y = self.x, self.y
+        self.x, self.y = x, y
+        self.tk_x, self.tk_y = self.world.get_xy_tkinter(x, y)
 
-        for res in resources:
-            x, y = res.getX(), res.getY()
-            if not self.world.is_occupied(x, y):
-                sugar_level = res.get_sugar_level()
-                if sugar_level > max_sugar:
-                    max_sugar = sugar_level
-                    max_x, max_y = x, y
-        return max_x, max_y
+    def set_capacity(self, ref_pos):
+        pos_tx, pos_ty, max_dist = ref_pos[0], ref_pos[1], ref_pos[2]
+        dist = self.world.distance(pos_tx-self.tk_x, pos_ty-self.tk_y)
 
-    def get_surrounding_resources(self):
-        surrounding_resources = []
+        capacity = 1 + Resource.MAX_CAPACITY * (1 - dist/max_dist)
+        if capacity < 0:
+            self.set_new_capacity(0)
+        else:
+            self.set_new_capacity(int(min(capacity, Resource.MAX_CAPACITY)))
+
+    def set_new_capacity(self, c):
+        self.landscape.set_capacity(self.x, self.y, c)
+
+    def set_sugar_level(self, sugar):
+        self.landscape.set_sugar(self.x, self.y, sugar)
 
-        min_pos_x, min_pos_y = self.world.get_min_grid_xy()
-        max_pos_x, max_pos_y = self.world.get_max_grid_xy()
-        grid_size = self.world.get_grid_size()
+    def get_capacity(self):
+        return int(self.landscape.capacity[self.x, self.y])
 
-        for d in Agent.MOVEMENT:
+    def get_sugar_level(self):
+        return int(self.landscape.get_sugar(self.x, self.y))
 
-            vis = 0
-            dir_x, dir_y = d[0], d[1]
-            x, y = self.x, self. y
+    def getX(self):
+        return self.x
+
+    def getY(self):
+        return self.y
+
+
+class AgentStore(object):
+    """
+    Agent population stored as parallel arrays, one row per agent.
+    -ids are stable across compaction and name the agent on the canvas
+    -dead agents are only flagged in alive; compact() drops them in one
+     batch at the end of a tick so rows stay valid while iterating
+    """
+    def __init__(self, size=0):
+        size = max(size, 1)
+        self.count = 0
+        self.next_id = 0
+
+        self.ids = np.zeros(size, dtype=np.int64)
+        self.x = np.zeros(size, dtype=np.int32)
+        self.y = np.zeros(size, dtype=np.int32)
+        self.vision = np.zeros(size, dtype=np.int32)
+        self.metabolism = np.zeros(size, dtype=np.int32)
+        self.wealth = np.zeros(size, dtype=np.int64)
+        self.alive = np.zeros(size, dtype=bool)
+
+    def columns(self):
+        return ["ids", "x", "y", "vision", "metabolism", "wealth", "alive"]
+
+    def add_many(self, x, y, vision, metabolism, wealth):
+        """
+        Appends one row per entry of the attribute arrays and returns the rows
+        """
+        num = len(x)
+        if self.count + num > len(self.ids):
+            self.resize(max(2*len(self.ids), self.count + num))
+
+        rows = np.arange(self.count, self.count + num)
+        self.ids[rows] = np.arange(self.next_id, self.next_id + num)
+        self.x[rows], self.y[rows] = x, y
+        self.vision[rows] = vision
+        self.metabolism[rows] = metabolism
+        self.wealth[rows] = wealth
+        self.alive[rows] = True
+
+        self.count += num
+        self.next_id += num
+        return rows
+
+    def resize(self, size):
+        for name in self.columns():
+            col = getattr(self, name)
+            new_col = np.zeros(size, dtype=col.dtype)
+            new_col[:self.count] = col[:self.count]
+            setattr(self, name, new_col)
+
+    def kill(self, row):
+        self.alive[row] = False
+
+    def compact(self):
+        """
+        Removes dead rows, keeping survivors in their original order.
+        Returns True if any row was removed
+        """
+        keep = self.alive[:self.count]
+        num_alive = int(np.count_nonzero(keep))
+        if num_alive == self.count:
+            return False
+
+        for name in self.columns():
+            col = getattr(self, name)
+            col[:num_alive] = col[:self.count][keep]
+
+        self.alive[num_alive:self.count] = False
+        self.count = num_alive
+        return True
+
+
+class Agent(object):
+    """
+    Read-only view of a single row of the world's AgentStore; agents are
+    moved by the rules of UPDATE_RULES, never one by one
+    """
+    MAX_VISION = 6
+    MAX_METABOLISM = 6
+    MIN_SUGAR, MAX_SUGAR = 5, 25
+    MOVEMENT = [(-1, 0), (1, 0), (0, 1), (0, -1)]
+    COLOR = "#000066"
+
+    def __init__(self, world, row):
+        self.world = world
+        self.agents = world.agents
+        self.row = row
 
-            while vis < self.vision:
-                x, y = x + dir_x, y + dir_y
+    @property
+    def x(self):
+        return int(self.agents.x[self.row])
 
-                if x > max_pos_x:
-                    x = x - grid_size
-                elif x < min_pos_x:
-                    x = x + grid_size
+    @property
+    def y(self):
+        return int(self.agents.y[self.row])
 
-                if y > max_pos_y:
-                    y = y - grid_size
-                elif y < min_pos_y:
-                    y = y + grid_size
+    @property
+    def vision(self):
+        return int(self.agents.vision[self.row])
 
-                resource = self.world.get_resource(x, y)
-                surrounding_resources.append(resource)
-                vis += 1
+    @property
+    def metabolism(self):
+        return int(self.agents.metabolism[self.row])
 
-        return surrounding_resources
+    @property
+    def wealth(self):
+        return int(self.agents.wealth[self.row])
 
     def is_alive(self):
-        return self.alive
-
-    def draw(self):
-        xmin, ymin = self.tk_x-self.world.get_dx()/2, self.tk_y-self.world.get_dy()/2
-        xmax, ymax = self.tk_x+self.world.get_dx()/2, self.tk_y+self.world.get_dy()/2
-
-        self.canvas.create_circle(x_min=xmin,
-                                  y_min=ymin,
-                                  x_max=xmax,
-                                  y_max=ymax,
-                                  color=self.color,
-                                  tag=self.idx,
-                                  stip="gray75")
+        return bool(self.agents.alive[self.row])
@@ -0,0 +1,159 @@
+import argparse
+import itertools as itr
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from Sugarscape import World
+from Metrics import MetricsCollector
+
+
+def param_grid(**axes):
+    """
+    Returns one run per combination of the given axes, e.g.
+    param_grid(pop=[100, 200], seed=range(10), ticks=[100]) gives 20 runs.
+    Parameters missing from axes keep the World defaults.
+    """
+    names = sorted(axes)
+    return [dict(zip(names, values)) for values in itr.product(*(list(axes[name]) for name in names))]
+
+
+def run_key(params):
+    """
+    Canonical string identifying a run, used to skip completed runs
+    """
+    return json.dumps({name: params[name] for name in sorted(params)}, sort_keys=True)
+
+
+def run_one(params):
+    """
+    Builds and runs one headless World and returns its summary. Runs in a
+    pool worker, so it only takes and returns plain data.
+    """
+    params = dict(params)
+    ticks = params.pop("ticks", 100)
+
+    start = time.perf_counter()
+    world = World(**params)
+    metrics = MetricsCollector(capacity=1)
+    metrics.attach(world)
+    world.initialize()
+
+    deaths = 0
+    for _ in range(ticks):
+        world.run()
+        deaths += int(metrics.latest()["deaths"])
+        if world.get_agent_count() == 0:
+            break
+
+    record = metrics.latest()
+    summary = {"params": dict(params, ticks=ticks),
+               "ticks_run": world.tick,
+               "seconds": time.perf_counter() - start,
+               "deaths": deaths}
+    for name in MetricsCollector.FIELDS:
+        if name not in ("tick", "deaths"):
+            summary[name] = float(record[name])
+    return summary
+
+
+def load_completed(path):
+    """
+    Returns the keys of the runs already written to a results file; a line
+    cut short by a crash is ignored
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+
+    with open(path) as f:
+        for line in f:
+            try:
+                completed.add(run_key(json.loads(line)["params"]))
+            except (ValueError, KeyError):
+                pass
+    return completed
+
+
+def ends_with_newline(path):
+    """
+    False when the last line of a non-empty results file was cut short
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return True
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def sweep(runs, workers=None, chunksize=1, completed=()):
+    """
+    Runs every run not in completed across a process pool and yields the
+    summaries as they finish, in completion order
+    """
+    pending = [params for params in runs if run_key(params) not in completed]
+    if not pending:
+        return
+
+    with multiprocessing.Pool(processes=workers) as pool:
+        for summary in pool.imap_unordered(run_one, pending, chunksize=chunksize):
+            yield summary
+
+
+def parse_seeds(text):
+    """
+    "7" gives seeds 0..6, "3-9" gives seeds 3..9, "1,5,8" gives those seeds
+    """
+    if "-" in text:
+        first, last = text.split("-")
+        return list(range(int(first), int(last) + 1))
+    if "," in text:
+        return [int(seed) for seed in text.split(",")]
+    return list(range(int(text)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parameter sweep of headless Sugarscape runs")
+    parser.add_argument("--pop", type=int, nargs="+", default=[200])
+    parser.add_argument("--grid-size", type=int, nargs="+", default=[50])
+    parser.add_argument("--radius", type=int, nargs="+", default=[250])
+    parser.add_argument("--max-vision", type=int, nargs="+", default=[6])
+    parser.add_argument("--max-metabolism", type=int, nargs="+", default=[6])
+    parser.add_argument("--update", nargs="+", default=["sequential"], choices=["sequential", "synchronous"])
+    parser.add_argument("--seeds", type=parse_seeds, default=parse_seeds("10"),
+                        help="count, first-last range or comma separated list")
+    parser.add_argument("--ticks", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None, help="default: one per core")
+    parser.add_argument("--chunksize", type=int, default=1)
+    parser.add_argument("--out", default="sweep.jsonl", help="results file, appended to and resumed from")
+    args = parser.parse_args(argv)
+
+    runs = param_grid(pop=args.pop,
+                      grid_size=args.grid_size,
+                      radius=args.radius,
+                      max_vision=args.max_vision,
+                      max_metabolism=args.max_metabolism,
+                      update=args.update,
+                      seed=args.seeds,
+                      ticks=[args.ticks])
+
+    completed = load_completed(args.out)
+    remaining = sum(1 for params in runs if run_key(params) not in completed)
+    print("%d runs, %d already completed" % (len(runs), len(runs) - remaining), file=sys.stderr)
+
+    with open(args.out, "a") as f:
+        # end a line cut short by a crash, so the next summary starts its own
+        if not ends_with_newline(args.out):
+            f.write("\n")
+        for done, summary in enumerate(sweep(runs, args.workers, args.chunksize, completed), 1):
+            f.write(json.dumps(summary) + "\n")
+            f.flush()
+            print("[%d/%d] %s population=%d gini=%.3f" % (done, remaining, run_key(summary["params"]),
+                                                         summary["population"], summary["gini"]),
+                  file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from Sugarscape import World, Landscape, AgentStore
+from Checkpoint import PARAMETERS
+
+
+# column files of a trajectory: name -> dtype, one value per entry
+SUGAR_COLUMNS = {"delta_cell": np.int64, "delta_sugar": None, "delta_end": np.int64}
+AGENT_COLUMNS = {"ids": np.int64, "x": np.int32, "y": np.int32, "wealth": np.int64, "alive": np.bool_,
+                 "agent_end": np.int64, "tick": np.int64}
+STATIC_COLUMNS = {"vision": np.int32, "metabolism": np.int32}
+# columns that count the frames, flushed after every other column
+INDEX_COLUMNS = ["tick", "delta_end", "agent_end"]
+
+
+class TrajectoryRecorder(object):
+    """
+    Observer that appends every tick of a world to a trajectory directory,
+    one raw binary file per column so a reader can memory map each of them.
+    -sugar is stored as the cells that changed since the previous frame and
+     their new level, plus a full keyframe every keyframe_every frames
+    -agents are stored as ids, x, y, wealth and alive for the rows of the
+     tick, dead agents included with alive False
+    -vision and metabolism never change, so they are stored once per agent,
+     indexed by agent id
+    -delta_end and agent_end hold where each frame ends in the delta and
+     agent files; they and tick are flushed after every other file, so a
+     reader never sees half a frame
+    Frame 0 is the world after initialize, frame t the world after tick t.
+    """
+    def __init__(self, path, keyframe_every=50):
+        self.path = path
+        self.keyframe_every = keyframe_every
+        self.files = {}
+        self.previous = None
+
+    def attach(self, world):
+        world.add_observer(self)
+        if hasattr(world, "agents"):
+            self.on_initialize(world)
+
+    def detach(self, world):
+        world.remove_observer(self)
+        self.close()
+
+    def on_initialize(self, world):
+        self.close()
+        os.makedirs(self.path, exist_ok=True)
+
+        capacity = np.asarray(world.landscape.capacity)
+        sugar_dtype = np.min_scalar_type(int(capacity.max()))
+        meta = {"params": dict({name: getattr(world, name) for name in PARAMETERS}, pop=world.agent_pop),
+                "keyframe_every": self.keyframe_every,
+                "sugar_dtype": np.dtype(sugar_dtype).str}
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        np.save(os.path.join(self.path, "capacity.npy"), capacity)
+
+        self.sugar_dtype = sugar_dtype
+        self.num_frames = 0
+        self.num_static = 0
+        self.num_deltas = 0
+        self.num_agents = 0
+        for name in list(SUGAR_COLUMNS) + list(AGENT_COLUMNS) + list(STATIC_COLUMNS) + ["keyframes"]:
+            self.files[name] = open(os.path.join(self.path, name + ".bin"), "wb")
+
+        self.previous = None
+        agents = world.agents
+        self.record(world, agents.alive[:agents.count])
+
+    def on_tick(self, world, events):
+        self.record(world, ~events.dead)
+
+    def record(self, world, alive):
+        sugar = np.asarray(world.landscape.get_sugar_grid(), dtype=self.sugar_dtype).reshape(-1)
+        if self.num_frames % self.keyframe_every == 0:
+            self.write("keyframes", sugar)
+
+        if self.previous is None:
+            cells = np.zeros(0, dtype=np.int64)
+        else:
+            cells = np.flatnonzero(sugar != self.previous)
+        self.write("delta_cell", cells.astype(np.int64))
+        self.write("delta_sugar", sugar[cells])
+        self.num_deltas += len(cells)
+        self.previous = sugar
+
+        agents = world.agents
+        n = len(alive)
+        for name in ["ids", "x", "y", "wealth"]:
+            self.write(name, getattr(agents, name)[:n].astype(AGENT_COLUMNS[name]))
+        self.write("alive", np.asarray(alive, dtype=np.bool_))
+        self.num_agents += n
+
+        # static attributes of agents born since the previous frame
+        if agents.next_id > self.num_static:
+            ids = agents.ids[:agents.count]
+            new = ids >= self.num_static
+            order = np.argsort(ids[new])
+            for name in STATIC_COLUMNS:
+                self.write(name, getattr(agents, name)[:agents.count][new][order].astype(STATIC_COLUMNS[name]))
+            self.num_static = agents.next_id
+
+        self.write("tick", np.array([world.tick], dtype=np.int64))
+        self.write("delta_end", np.array([self.num_deltas], dtype=np.int64))
+        self.write("agent_end", np.array([self.num_agents], dtype=np.int64))
+        self.num_frames += 1
+
+        for name, f in self.files.items():
+            if name not in INDEX_COLUMNS:
+                f.flush()
+        for name in INDEX_COLUMNS:
+            self.files[name].flush()
+
+    def write(self, name, array):
+        self.files[name].write(np.ascontiguousarray(array).tobytes())
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+class Trajectory(object):
+    """
+    Read side of a trajectory directory. Every column file is memory mapped,
+    so opening a run costs the same however long it is and a frame only
+    reads the bytes it needs. refresh() picks up frames appended since, when
+    the run is still being recorded.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        self.params = self.meta["params"]
+        self.keyframe_every = self.meta["keyframe_every"]
+        self.sugar_dtype = np.dtype(self.meta["sugar_dtype"])
+        self.capacity = np.load(os.path.join(path, "capacity.npy"), mmap_mode="r")
+        self.grid_size = self.capacity.shape[0]
+
+        self.refresh()
+
+    def refresh(self):
+        dtypes = dict(SUGAR_COLUMNS, **AGENT_COLUMNS)
+        dtypes.update(STATIC_COLUMNS)
+        dtypes["delta_sugar"] = dtypes["keyframes"] = self.sugar_dtype
+
+        self.columns = {name: self.map(name, dtype) for name, dtype in dtypes.items()}
+        self.num_frames = min(len(self.columns["delta_end"]), len(self.columns["agent_end"]),
+                              len(self.columns["tick"]))
+
+        num_cells = self.grid_size*self.grid_size
+        self.keyframes = self.columns["keyframes"][:len(self.columns["keyframes"]) // num_cells * num_cells]
+        self.keyframes = self.keyframes.reshape(-1, num_cells)
+
+        # a frame is only complete once its keyframe and the static columns
+        # of its agents are on disk too
+        self.num_frames = min(self.num_frames, len(self.keyframes)*self.keyframe_every)
+        num_static = min(len(self.columns[name]) for name in STATIC_COLUMNS)
+        while self.num_frames > 0:
+            ids = self.agents(self.num_frames - 1)["ids"]
+            if len(ids) == 0 or ids.max() < num_static:
+                break
+            self.num_frames -= 1
+
+    def map(self, name, dtype):
+        path = os.path.join(self.path, name + ".bin")
+        size = os.path.getsize(path) // np.dtype(dtype).itemsize
+        if size == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(size,))
+
+    def get_num_frames(self):
+        return self.num_frames
+
+    def get_tick(self, frame):
+        return int(self.columns["tick"][frame])
+
+    def deltas(self, frame):
+        """
+        Returns the cells that changed in frame and their new sugar level
+        """
+        end = self.columns["delta_end"]
+        start = end[frame-1] if frame > 0 else 0
+        return self.columns["delta_cell"][start:end[frame]], self.columns["delta_sugar"][start:end[frame]]
+
+    def sugar(self, frame, grid=None, grid_frame=None):
+        """
+        Returns the flat sugar grid of frame. Given the grid of an earlier
+        grid_frame it is updated in place when that is closer than the
+        keyframe of frame, which makes stepping through a run cheap.
+        """
+        keyframe = frame // self.keyframe_every
+        start = keyframe*self.keyframe_every
+        if grid is None or grid_frame is None or not start <= grid_frame <= frame:
+            grid = np.array(self.keyframes[keyframe], dtype=np.int32)
+            grid_frame = start
+
+        for f in range(grid_frame + 1, frame + 1):
+            cells, sugar = self.deltas(f)
+            grid[cells] = sugar
+        return grid
+
+    def agents(self, frame):
+        """
+        Returns the agent columns of frame, name -> array, dead agents included
+        """
+        end = self.columns["agent_end"]
+        start = end[frame-1] if frame > 0 else 0
+        return {name: self.columns[name][start:end[frame]] for name in ["ids", "x", "y", "wealth", "alive"]}
+
+    def static(self, ids):
+        return {name: self.columns[name][ids] for name in STATIC_COLUMNS}
+
+
+class Replay(object):
+    """
+    Plays a recorded trajectory back through a RenderSink. The frames are
+    loaded into a World that is never run, so the renderers and anything
+    else reading a world work unchanged.
+    """
+    def __init__(self, trajectory, canvas=None):
+        self.trajectory = trajectory
+        params = dict(trajectory.params)
+        params["workers"] = 1
+        self.world = World(canvas=canvas, **params)
+
+        self.world.landscape = Landscape(0)
+        self.world.landscape.grid_size = trajectory.grid_size
+        self.world.landscape.capacity = np.asarray(trajectory.capacity)
+        self.world.agents = AgentStore()
+
+        self.frame = None
+        self.grid = None
+
+    def get_num_frames(self):
+        return self.trajectory.get_num_frames()
+
+    def seek(self, frame, render=True):
+        """
+        Loads frame into the world, keeping only living agents as a run would
+        after compaction, and draws it
+        """
+        trajectory = self.trajectory
+        self.grid = trajectory.sugar(frame, self.grid, self.frame)
+        self.frame = frame
+
+        world = self.world
+        world.tick = trajectory.get_tick(frame)
+        world.landscape.sugar_level = self.grid.reshape(trajectory.grid_size, trajectory.grid_size)
+
+        columns = trajectory.agents(frame)
+        alive = np.asarray(columns["alive"])
+        agents = world.agents
+        for name in ["ids", "x", "y", "wealth"]:
+            setattr(agents, name, np.asarray(columns[name])[alive].astype(AGENT_COLUMNS[name]))
+        for name, column in trajectory.static(agents.ids).items():
+            setattr(agents, name, np.asarray(column))
+        agents.alive = np.ones(len(agents.ids), dtype=bool)
+        agents.count = len(agents.ids)
+
+        if render:
+            world.render()
+        return world
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record a headless Sugarscape run for replay")
+    parser.add_argument("path", help="trajectory directory")
+    parser.add_argument("--pop", type=int, default=200)
+    parser.add_argument("--grid-size", type=int, default=50)
+    parser.add_argument("--radius", type=int, default=250)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--ticks", type=int, default=100)
+    parser.add_argument("--keyframe-every", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    world = World(grid_size=args.grid_size, pop=args.pop, radius=args.radius, seed=args.seed)
+    recorder = TrajectoryRecorder(args.path, args.keyframe_every)
+    recorder.attach(world)
+    world.initialize()
+
+    for _ in range(args.ticks):
+        world.run(render=False)
+        if world.get_agent_count() == 0:
+            break
+    recorder.close()
+    print("%d frames written to %s" % (recorder.num_frames, args.path), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
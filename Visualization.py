@@ -1,10 +1,17 @@
 import tkinter as tk
+import tkinter.messagebox as box
+import tkinter.filedialog as dialog
 import itertools as itr
 import math as m
+import time
 
+import numpy as np
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from Sugarscape import World
+from Sugarscape import World, RenderSink, Resource, Agent
+from Raster import Raster, encode_ppm
+from Metrics import MetricsCollector
+from Trajectory import Trajectory, Replay
 
 
 class Frame:
@@ -18,16 +25,28 @@ class Frame:
 
 
 class Plot:
+    """
+    Live plots of the world's metrics, one panel per metric. Each panel keeps
+    a single Line2D that is updated with set_data and blitted over a cached
+    background; the full figure is only redrawn when a series leaves the
+    current axes range. Long histories are thinned by doubling the stride,
+    so each draw costs the same however long the run is.
+    """
+    MAX_POINTS = 2000
+
     def __init__(self, frame):
         self.frame = frame
         self.plot_names = ["Population", "Average Wealth", "Average Vision", "Average Metabolism"]
-        self.plots = {}
+        self.panels = []
 
         num_rows = num_cols = int(len(self.plot_names)/2)
         for i, j in itr.product(range(num_rows), range(num_cols)):
             idx = i*num_cols + j
             plot, plot_canvas = self.plot_widget(i, j, idx)
-            self.plots[plot_canvas] = plot
+            line, = plot.plot([], [], color="orange", animated=True)
+            self.panels.append([plot, plot_canvas, line, None])
+
+        self.reset()
 
     def plot_widget(self, row, col, idx):
         plot = Figure(figsize=(3, 3))
@@ -36,33 +55,79 @@ class Plot:
         sub_plot.grid()
         sub_plot.set_title(self.plot_names[idx])
 
+        return sub_plot, self.figure_canvas(plot, row, col)
+
+    def figure_canvas(self, plot, row, col):
         plot_canvas = FigureCanvasTkAgg(plot, self.frame)
         plot_canvas.get_tk_widget().grid(row=row, column=col, padx=2, pady=2, sticky="n")
+        return plot_canvas
 
-        return sub_plot, plot_canvas
-
-    def draw(self, xlist, ylist):
-        idx = 0
-        for canvas, plt in self.plots.items():
-            plt.cla()
-            plt.plot(xlist, ylist, color="orange")
-            plt.set_title(self.plot_names[idx])
-            plt.grid()
-
-            canvas.draw()
-
-            idx += 1
+    def reset(self):
+        self.stride = 1
+        self.num_added = 0
+        self.xlist = []
+        self.ylists = [[] for _ in self.plot_names]
+
+    def add(self, x, values):
+        """
+        Records one sample; values holds one number per panel, in the order
+        of plot_names
+        """
+        if self.num_added % self.stride == 0:
+            self.xlist.append(x)
+            for ylist, value in zip(self.ylists, values):
+                ylist.append(value)
+
+            if len(self.xlist) > Plot.MAX_POINTS:
+                self.stride *= 2
+                self.xlist = self.xlist[::2]
+                self.ylists = [ylist[::2] for ylist in self.ylists]
+
+        self.num_added += 1
+
+    def draw(self):
+        if not self.xlist:
+            return
+
+        x_max = self.xlist[-1]
+        for panel, ylist in zip(self.panels, self.ylists):
+            plot, canvas, line, background = panel
+            line.set_data(self.xlist, ylist)
+
+            if background is None or self.out_of_range(plot, x_max, ylist[-1]):
+                self.rescale(plot, x_max, ylist)
+                canvas.draw()
+                panel[3] = background = canvas.copy_from_bbox(plot.bbox)
+
+            canvas.restore_region(background)
+            plot.draw_artist(line)
+            canvas.blit(plot.bbox)
+
+    def out_of_range(self, plot, x, y):
+        x_min, x_max = plot.get_xlim()
+        y_min, y_max = plot.get_ylim()
+        return not (x_min <= x <= x_max and y_min <= y <= y_max)
+
+    def rescale(self, plot, x_max, ylist):
+        """
+        Grows the axes with head room so that rescaling, and the full redraw
+        that comes with it, stays rare
+        """
+        plot.set_xlim(0, max(10, 2*x_max))
+
+        y_min, y_max = min(ylist), max(ylist)
+        margin = max(1.0, 0.25*(y_max - y_min))
+        plot.set_ylim(0 if y_min >= 0 else y_min - margin, y_max + margin)
 
     def clear(self):
-        idx = 0
-        for canvas, plt in self.plots.items():
-            plt.cla()
-            plt.set_title(self.plot_names[idx])
-            plt.grid()
-
+        self.reset()
+        for panel in self.panels:
+            plot, canvas, line, background = panel
+            line.set_data([], [])
+            plot.set_xlim(0, 1)
+            plot.set_ylim(0, 1)
             canvas.draw()
-
-            idx += 1
+            panel[3] = None
 
 
 class Label:
@@ -122,6 +187,9 @@ class Scale:
     def get_value(self):
         return self.scale.get()
 
+    def set_command(self, command):
+        self.scale["command"] = command
+
 
 class Button:
     def __init__(self, frame, row, col):
@@ -150,13 +218,54 @@ class Button:
         self.button["command"] = command
 
 
-class Canvas:
+class Option:
+    def __init__(self, frame, row, col, values):
+        self.value = tk.StringVar(frame, values[0])
+        self.option = tk.OptionMenu(frame, self.value, *values)
+        self.option.config(font="Arial 10",
+                           width=17,
+                           relief="raised")
+        self.option.grid(row=row, column=col, columnspan=3, sticky="w")
+
+    def set_value(self, value):
+        self.value.set(value)
+
+    def get_value(self):
+        return self.value.get()
+
+
+class Canvas(RenderSink):
+    BACKGROUND = "#E0E0E0"
+
     def __init__(self, frame, row, col):
-        self.canvas = tk.Canvas(frame,
-                                width=100,
-                                height=100,
-                                background="#E0E0E0")
-        self.canvas.grid(row=row, column=col)
+        self.canvas = self.create_widget(frame, row, col)
+
+        # palette[bucket_lut[sugar]] is the color of a cell holding that much sugar
+        self.palette = [Canvas.BACKGROUND]
+        self.bucket_lut = np.zeros(Resource.MAX_CAPACITY + 1, dtype=np.int32)
+        for sugar in range(1, Resource.MAX_CAPACITY + 1):
+            color = Resource.COLORS[sugar]
+            if color not in self.palette:
+                self.palette.append(color)
+            self.bucket_lut[sugar] = self.palette.index(color)
+
+        self.reset()
+
+    def create_widget(self, frame, row, col):
+        canvas = tk.Canvas(frame,
+                           width=100,
+                           height=100,
+                           background=Canvas.BACKGROUND)
+        canvas.grid(row=row, column=col)
+        return canvas
+
+    def reset(self):
+        self.world = None
+        self.buckets = None
+        self.num_repainted = 0
+        self.agent_ids = np.zeros(0, dtype=np.int64)
+        self.agent_x = np.zeros(0, dtype=np.int32)
+        self.agent_y = np.zeros(0, dtype=np.int32)
 
     def set_width(self, width):
         self.canvas["width"] = width
@@ -188,6 +297,138 @@ class Canvas:
 
     def delete(self):
         self.canvas.delete("all")
+        self.reset()
+
+    def render(self, world):
+        """
+        Draws the world's changes since the previous call as one batch:
+        -cells are repainted only when their color bucket changed
+        -agent ovals are created, moved or deleted, never recreated
+        The first call for a world draws everything.
+        """
+        if world is not self.world:
+            self.delete()
+            self.world = world
+            self.tk_xs, self.tk_ys = world.get_tkinter_axes()
+
+        self.render_cells(world)
+        self.render_agents(world)
+
+    def render_cells(self, world):
+        buckets = self.bucket_lut[world.landscape.get_sugar_grid()]
+
+        if self.buckets is None:
+            xs, ys = np.nonzero(world.landscape.capacity)
+            for x, y in zip(xs.tolist(), ys.tolist()):
+                tk_x, tk_y = self.tk_xs[x], self.tk_ys[y]
+                self.create_rectangle(x_min=tk_x,
+                                      y_min=tk_y,
+                                      x_max=tk_x + world.get_dx(),
+                                      y_max=tk_y + world.get_dy(),
+                                      color=self.palette[buckets[x, y]],
+                                      tag=self.cell_tag(world, x, y))
+        else:
+            xs, ys = np.nonzero(buckets != self.buckets)
+            for x, y in zip(xs.tolist(), ys.tolist()):
+                self.update_rectangle(self.cell_tag(world, x, y), self.palette[buckets[x, y]])
+
+        self.num_repainted = len(xs)
+
+        self.buckets = buckets
+
+    def render_agents(self, world):
+        agents = world.agents
+        ids = agents.ids[:agents.count]
+        xs, ys = agents.x[:agents.count], agents.y[:agents.count]
+
+        # ids stay sorted in the AgentStore, so the rows kept on both sides line up
+        kept_before = np.isin(self.agent_ids, ids)
+        kept_now = np.isin(ids, self.agent_ids)
+
+        for idx in self.agent_ids[~kept_before].tolist():
+            self.delete_circle(self.agent_tag(idx))
+
+        old_x, old_y = self.agent_x[kept_before], self.agent_y[kept_before]
+        new_x, new_y = xs[kept_now], ys[kept_now]
+        moved = np.flatnonzero((old_x != new_x) | (old_y != new_y))
+        kept_ids = ids[kept_now]
+
+        for i in moved.tolist():
+            self.move_circle(self.agent_tag(kept_ids[i]),
+                             self.tk_xs[new_x[i]] - self.tk_xs[old_x[i]],
+                             self.tk_ys[new_y[i]] - self.tk_ys[old_y[i]])
+
+        dx, dy = world.get_dx(), world.get_dy()
+        for idx, x, y in zip(ids[~kept_now].tolist(), xs[~kept_now].tolist(), ys[~kept_now].tolist()):
+            tk_x, tk_y = self.tk_xs[x], self.tk_ys[y]
+            self.create_circle(x_min=tk_x - dx/2,
+                               y_min=tk_y - dy/2,
+                               x_max=tk_x + dx/2,
+                               y_max=tk_y + dy/2,
+                               color=Agent.COLOR,
+                               tag=self.agent_tag(idx),
+                               stip="gray75")
+
+        self.agent_ids, self.agent_x, self.agent_y = ids.copy(), xs.copy(), ys.copy()
+
+    def cell_tag(self, world, x, y):
+        return "sugar" + str(x*world.get_grid_size() + y)
+
+    def agent_tag(self, idx):
+        return "agent" + str(idx)
+
+    def show(self):
+        self.canvas.grid()
+
+    def hide(self):
+        self.canvas.grid_remove()
+
+
+class ImageCanvas(RenderSink):
+    """
+    Draws the whole world as a single PhotoImage built by Raster, so the cost
+    of a frame does not depend on how many cells or agents there are
+    """
+    def __init__(self, frame, row, col):
+        self.canvas = tk.Canvas(frame,
+                                width=100,
+                                height=100,
+                                background=Canvas.BACKGROUND)
+        self.canvas.grid(row=row, column=col)
+
+        self.raster = Raster()
+        self.image = None
+        self.photo = None
+        self.num_repainted = 0
+
+    def set_width(self, width):
+        self.canvas["width"] = width
+
+    def set_height(self, height):
+        self.canvas["height"] = height
+
+    def render(self, world):
+        size = min(int(self.canvas["width"]), int(self.canvas["height"]))
+        frame = self.raster.frame(world, size)
+        self.num_repainted = world.get_grid_size()*world.get_grid_size()
+
+        # keep a reference to the photo or tkinter garbage collects it
+        self.photo = tk.PhotoImage(data=encode_ppm(frame), format="PPM")
+        if self.image is None:
+            self.image = self.canvas.create_image(0, 0, image=self.photo, anchor="nw")
+        else:
+            self.canvas.itemconfig(self.image, image=self.photo)
+
+    def delete(self):
+        self.canvas.delete("all")
+        self.image = None
+        self.photo = None
+
+    def show(self):
+        self.canvas.grid()
+
+    def hide(self):
+        self.canvas.grid_remove()
 
 
 class Visualization:
@@ -199,6 +440,15 @@ class Visualization:
         self.width = 700
         self.height = 700
 
+        self.world = None
+        self.replay = None
+        self.scale_frame = 0
+        self.show_stats = False
+        self.running = False
+        self.after_id = None
+        self.t = 0
+        self.max_ticks = 0
+
         # Frame for inputs
         self.inputFrame = Frame(self.window).get_frame(row=0, col=0)
         self.inputs()
@@ -256,26 +506,99 @@ class Visualization:
         self.radius_scale.set_value(value=250)
         self.radius_scale.set_tick_interval(interval=200)
 
+        # Creates label and option for the renderer
+        self.renderer_label = Label(self.inputFrame, row=4, col=0)
+        self.renderer_label.set_text("Renderer")
+
+        self.renderer_option = Option(self.inputFrame, row=4, col=1, values=["Canvas", "Raster"])
+
+        max_render_every = 50
+
+        # Creates label and scale for how many ticks pass between two frames
+        self.render_label = Label(self.inputFrame, row=5, col=0)
+        self.render_label.set_text("Render Every N Ticks")
+
+        self.render_scale = Scale(self.inputFrame, row=5, col=1)
+        self.render_scale.set_range(1, max_render_every)
+        self.render_scale.set_value(1)
+        self.render_scale.set_tick_interval(max_render_every-1)
+
+        max_fps = 60
+        init_fps = 20
+
+        # Creates label and scale for the target frame rate
+        self.fps_label = Label(self.inputFrame, row=6, col=0)
+        self.fps_label.set_text("Target FPS")
+
+        self.fps_scale = Scale(self.inputFrame, row=6, col=1)
+        self.fps_scale.set_range(1, max_fps)
+        self.fps_scale.set_value(init_fps)
+        self.fps_scale.set_tick_interval(max_fps-1)
+
 
     def buttons(self):
-        self.initialize_btn = Button(self.inputFrame, row=4, col=0)
+        self.initialize_btn = Button(self.inputFrame, row=7, col=0)
         self.initialize_btn.set_text("Initialize")
         self.initialize_btn.set_command(self.initialize)
 
-        self.run_btn = Button(self.inputFrame, row=4, col=1)
+        self.run_btn = Button(self.inputFrame, row=7, col=1)
         self.run_btn.set_text("Run")
         self.run_btn.set_relief("sunken")
         self.run_btn.set_command(self.run)
 
-        self.quit_btn = Button(self.inputFrame, row=4, col=2)
+        self.quit_btn = Button(self.inputFrame, row=7, col=2)
         self.quit_btn.set_text("Quit")
         self.quit_btn.set_command(self.quit)
 
+        self.pause_btn = Button(self.inputFrame, row=8, col=0)
+        self.pause_btn.set_text("Pause")
+        self.pause_btn.set_relief("sunken")
+        self.pause_btn.set_command(self.pause)
+
+        self.speed_label = Label(self.inputFrame, row=8, col=1)
+        self.speed_label.set_text("Tick 0\n0 ticks/s")
+
+        # Replay of a run recorded by Trajectory.TrajectoryRecorder
+        self.replay_btn = Button(self.inputFrame, row=9, col=0)
+        self.replay_btn.set_text("Replay...")
+        self.replay_btn.set_command(self.open_replay)
+
+        self.stats_btn = Button(self.inputFrame, row=9, col=1)
+        self.stats_btn.set_text("Tick Stats")
+        self.stats_btn.set_command(self.toggle_stats)
+
+        self.frame_label = Label(self.inputFrame, row=10, col=0)
+        self.frame_label.set_text("Replay Frame")
+
+        self.frame_scale = Scale(self.inputFrame, row=10, col=1)
+        self.frame_scale.set_range(0, 0)
+        self.frame_scale.set_value(0)
+        self.frame_scale.set_tick_interval(0)
+        self.frame_scale.set_command(self.scrub)
+
 
     def animation(self):
-        self.animationCanvas = Canvas(self.animationFrame, row=0, col=0)
-        self.animationCanvas.set_width(self.width)
-        self.animationCanvas.set_height(self.height)
+        self.itemCanvas = Canvas(self.animationFrame, row=0, col=0)
+        self.itemCanvas.set_width(self.width)
+        self.itemCanvas.set_height(self.height)
+
+        self.imageCanvas = ImageCanvas(self.animationFrame, row=0, col=0)
+        self.imageCanvas.set_width(self.width)
+        self.imageCanvas.set_height(self.height)
+        self.imageCanvas.hide()
+
+        self.animationCanvas = self.itemCanvas
+
+    def select_renderer(self):
+        self.animationCanvas.delete()
+        self.animationCanvas.hide()
+
+        if self.renderer_option.get_value() == "Raster":
+            self.animationCanvas = self.imageCanvas
+        else:
+            self.animationCanvas = self.itemCanvas
+
+        self.animationCanvas.show()
 
     def plots(self):
         self.graphs = Plot(self.plotFrame)
@@ -287,13 +610,17 @@ class Visualization:
         return frame
 
     def initialize(self):
+        self.stop()
         self.graphs.clear()
+        self.replay = None
 
-        self.xlist = []
-        self.ylist = []
+        self.t = 0
+        self.max_ticks = 0
 
         self.run_btn.set_relief("raised")
-        self.animationCanvas.delete()
+        self.pause_btn.set_relief("sunken")
+        self.speed_label.set_text("Tick 0\n0 ticks/s")
+        self.select_renderer()
 
         grid_size = int(self.grid_scale.get_value())
         agent_pop = int(self.num_scale.get_value())
@@ -305,25 +632,189 @@ class Visualization:
                            grid_size=grid_size,
                            pop=agent_pop,
                            radius=radius)
-        self.world.initialize()
+        self.metrics = MetricsCollector()
+        self.metrics.attach(self.world)
+        if self.show_stats:
+            self.world.enable_stats()
+        try:
+            self.world.initialize()
+        except ValueError as err:
+            self.world = None
+            box.showerror("Error", str(err))
+
+    def toggle_stats(self):
+        """
+        Switches the per-phase timers of the world and their overlay on the
+        animation canvas on or off
+        """
+        self.show_stats = not self.show_stats
+        self.stats_btn.set_relief("sunken" if self.show_stats else "raised")
+
+        if self.world is not None and self.replay is None:
+            if self.show_stats:
+                self.world.enable_stats()
+            else:
+                self.world.disable_stats()
+        self.draw_stats()
+
+    def draw_stats(self):
+        canvas = self.animationCanvas.canvas
+        canvas.delete("stats")
+
+        stats = self.world.stats if self.world is not None else None
+        if not self.show_stats or stats is None or stats.latest() is None:
+            return
+        canvas.create_text(8, 8, anchor="nw", text=stats.format_latest(), font="Courier 9",
+                           fill="#000000", tag="stats")
+
+    def open_replay(self):
+        """
+        Loads a recorded trajectory; Run then plays it back and the frame
+        scale scrubs through it, reading frames from the mapped files
+        """
+        path = dialog.askdirectory(title="Trajectory directory")
+        if not path:
+            return
+
+        self.stop()
+        try:
+            trajectory = Trajectory(path)
+        except (OSError, ValueError, KeyError) as err:
+            box.showerror("Error", "Not a trajectory: " + str(err))
+            return
 
-    def run(self):
-        self.run_btn.set_relief("sunken")
+        self.graphs.clear()
+        self.select_renderer()
+        self.replay = Replay(trajectory, self.animationCanvas)
+        self.world = self.replay.world
 
-        max_ticks = int(self.ticks_scale.get_value())
-        t = 0
+        self.t = 0
+        self.max_ticks = 0
+        self.run_btn.set_relief("raised")
+        self.pause_btn.set_relief("sunken")
 
-        while t < max_ticks:
-            self.world.run()
+        last = trajectory.get_num_frames() - 1
+        self.frame_scale.set_range(0, last)
+        self.frame_scale.set_tick_interval(max(1, last))
+        self.show_frame(0)
 
-            self.xlist.append(t)
-            self.ylist.append(self.world.get_agent_count())
+    def scrub(self, value):
+        # the scale also reports the positions set by show_frame and step
+        frame = int(value)
+        if self.replay is None or frame == self.scale_frame:
+            return
 
-            self.graphs.draw(self.xlist, self.ylist)
+        self.stop()
+        self.run_btn.set_relief("raised")
+        self.pause_btn.set_relief("sunken")
+        self.show_frame(frame)
 
-            t += 1.0
+    def show_frame(self, frame):
+        self.t = frame
+        self.replay.seek(frame)
+        self.scale_frame = frame
+        self.frame_scale.set_value(frame)
+        self.speed_label.set_text("Tick " + str(self.world.tick) + "\nframe " + str(frame))
+
+    def run(self):
+        """
+        Runs the selected number of ticks without blocking the window: step()
+        advances the world in short batches scheduled through window.after.
+        In replay mode the ticks are read back from the trajectory instead
+        """
+        if self.world is None or self.running:
+            return
+
+        self.max_ticks = self.t + int(self.ticks_scale.get_value())
+        if self.replay is not None:
+            self.replay.trajectory.refresh()
+            self.max_ticks = min(self.max_ticks, self.replay.get_num_frames() - 1)
+            if self.max_ticks <= self.t:
+                return
+
+        self.run_btn.set_relief("sunken")
+        self.pause_btn.set_relief("raised")
+        self.pause_btn.set_text("Pause")
+        self.resume()
+
+    def pause(self):
+        if self.running:
+            self.stop()
+            self.pause_btn.set_text("Resume")
+        elif self.t < self.max_ticks:
+            self.pause_btn.set_text("Pause")
+            self.resume()
+
+    def resume(self):
+        self.running = True
+        self.speed_start, self.speed_ticks = time.perf_counter(), 0
+        self.after_id = self.window.after(0, self.step)
+
+    def stop(self):
+        self.running = False
+        if self.after_id is not None:
+            self.window.after_cancel(self.after_id)
+            self.after_id = None
+
+    def step(self):
+        """
+        Steps the world until a frame is due, either because render_every
+        ticks have passed or because the frame budget of the target frame rate
+        is used up, then draws that frame and schedules the next step
+        """
+        render_every = int(self.render_scale.get_value())
+        budget = 1.0 / int(self.fps_scale.get_value())
+        start = time.perf_counter()
+
+        while self.t < self.max_ticks:
+            self.t += 1
+            render = self.t % render_every == 0 or self.t == self.max_ticks
+            if self.replay is not None:
+                self.replay.seek(self.t, render=render)
+                self.graphs.add(self.t, [self.world.get_agent_count(),
+                                         self.world.get_average_wealth(),
+                                         self.world.get_average_vision(),
+                                         self.world.get_average_metabolism()])
+            else:
+                self.world.run(render=render)
+
+                record = self.metrics.latest()
+                self.graphs.add(self.t, [record["population"],
+                                         record["wealth_mean"],
+                                         record["vision_mean"],
+                                         record["metabolism_mean"]])
+            self.speed_ticks += 1
+
+            if render or time.perf_counter() - start >= budget:
+                break
+
+        self.graphs.draw()
+        self.show_speed()
+        self.draw_stats()
+        if self.replay is not None:
+            self.scale_frame = self.t
+            self.frame_scale.set_value(self.t)
+
+        if self.t >= self.max_ticks:
+            self.stop()
+            self.run_btn.set_relief("raised")
+            self.pause_btn.set_relief("sunken")
+            return
+
+        delay = max(1, int(1000*(budget - (time.perf_counter() - start))))
+        self.after_id = self.window.after(delay, self.step)
+
+    def show_speed(self):
+        now = time.perf_counter()
+        tps = self.speed_ticks / max(now - self.speed_start, 1e-9)
+        self.speed_label.set_text("Tick " + str(self.t) + "\n" + str(int(round(tps))) + " ticks/s")
+
+        # average over roughly the last second only
+        if now - self.speed_start > 1.0:
+            self.speed_start, self.speed_ticks = now, 0
 
     def quit(self):
+        self.stop()
         self.window.destroy()
 
     def loop(self):